@@ -0,0 +1,317 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import psycopg2
+
+import db
+import ledger
+import records
+
+MAX_BODY_BYTES = 4 * 1024 * 1024
+HISTORY_PAGE_LIMIT = 500
+ENTRY_FIELDS = {'Type': 'type', 'Total Amount': 'total_amount', 'Amount Received': 'amount_received', 'Note': 'note'}
+
+_settings = {}
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, errors=None):
+        super().__init__(message)
+        self.status = status
+        self.errors = errors
+
+
+def api_secret():
+    return _settings["API_SECRET"].encode()
+
+
+def issue_token(user_id):
+    expires = int(time.time() + float(_settings.get("API_TOKEN_TTL", 12 * 3600)))
+    payload = f"{user_id}.{expires}"
+    signature = hmac.new(api_secret(), payload.encode(), hashlib.sha256).hexdigest()
+    return f"{payload}.{signature}", expires
+
+
+def verify_token(token):
+    # Tokens are signed rather than stored, so any API process sharing API_SECRET accepts them.
+    try:
+        user_id, expires, signature = token.split('.')
+        user_id, expires = int(user_id), int(expires)
+    except ValueError:
+        return None
+    expected = hmac.new(api_secret(), f"{user_id}.{expires}".encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(signature, expected) or expires < time.time():
+        return None
+    return user_id
+
+
+def user_session(user_id):
+    # Read-your-writes across a terminal's requests, the way the UI keeps it per browser session.
+    with _sessions_lock:
+        if user_id not in _sessions:
+            _sessions[user_id] = records.new_session()
+        return _sessions[user_id]
+
+
+def to_json(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def encode_cursor(key):
+    date_time, trans_id = key
+    return f"{date_time.isoformat()}|{trans_id}"
+
+
+def decode_cursor(cursor):
+    try:
+        date_time, trans_id = cursor.split('|')
+        return datetime.fromisoformat(date_time), int(trans_id)
+    except ValueError:
+        raise ApiError(400, f"Invalid cursor: {cursor!r}")
+
+
+def parse_date_time(value):
+    try:
+        date_time = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"date_time is not a valid ISO date: {value!r}")
+    return records.to_local_naive(date_time).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_transaction(entry, now):
+    if not isinstance(entry, dict):
+        raise ValueError("Each transaction must be an object")
+    customer_id = entry.get('customer_id')
+    if not isinstance(customer_id, int) or isinstance(customer_id, bool):
+        raise ValueError("customer_id must be an integer")
+    note = entry.get('note')
+    if note is not None and not isinstance(note, str):
+        raise ValueError("note must be a string")
+    # Same checks as the entry grid (including amount_received <= total_amount, so nothing is stored
+    # with a negative amount_left), reported with the API's field names.
+    try:
+        trans_type, total_amount, amount_received, amount_left, note = records.parse_entry_row(
+            {column: note if field == 'note' else entry.get(field) for column, field in ENTRY_FIELDS.items()})
+    except ValueError as e:
+        message = str(e)
+        for column, field in ENTRY_FIELDS.items():
+            message = message.replace(column, field)
+        raise ValueError(message)
+    date_time = parse_date_time(entry['date_time']) if entry.get('date_time') is not None else now
+    return customer_id, date_time, trans_type, total_amount, amount_received, amount_left, note
+
+
+def owned(user_id, customer_ids):
+    customer_ids = tuple(sorted(set(customer_ids)))
+    missing = set(customer_ids) - records.get_owned_customers(user_id, customer_ids)
+    if missing:
+        raise ApiError(404, f"Unknown customer(s): {', '.join(map(str, sorted(missing)))}")
+    return customer_ids
+
+
+def parse_id(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be an integer")
+
+
+def balance_json(row):
+    amounts = {column: records.to_decimal(row[column]) for column in ('received', 'given', 'net', 'pending')}
+    return {'customer_id': row['id'], 'name': row['name'], **amounts, 'transaction_count': row['transaction_count']}
+
+
+def login(body, query):
+    if not isinstance(body, dict):
+        raise ApiError(400, "Expected a JSON object")
+    success, user_id, name = records.login_user(str(body.get('email') or ''), str(body.get('password') or ''))
+    if not success:
+        raise ApiError(401, "Invalid email or password")
+    token, expires = issue_token(user_id)
+    return 200, {'token': token, 'expires_at': expires, 'user_id': user_id, 'name': name}
+
+
+def list_customers(user_id, query):
+    limit = parse_id(query.get('limit', records.CUSTOMER_SEARCH_LIMIT), 'limit')
+    customers, total = records.search_customers(user_id, query.get('search', ''), max(1, min(limit, 1000)))
+    return 200, {'customers': [{'id': customer_id, 'name': name} for customer_id, name in customers], 'total': total}
+
+
+def post_transactions(user_id, body, query):
+    entries = body.get('transactions') if isinstance(body, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ApiError(400, "Expected {\"transactions\": [...]} with at least one transaction")
+    max_batch = int(_settings.get("API_MAX_BATCH", 1000))
+    if len(entries) > max_batch:
+        raise ApiError(413, f"At most {max_batch} transactions per request")
+    now = records.get_local_time().strftime('%Y-%m-%d %H:%M:%S')
+    rows, errors = [], []
+    for index, entry in enumerate(entries):
+        try:
+            rows.append(parse_transaction(entry, now))
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise ApiError(400, "Some transactions are invalid; nothing was saved", errors)
+    customer_ids = owned(user_id, (row[0] for row in rows))
+    # One statement and one commit for the whole batch, so it is saved entirely or not at all.
+    records.insert_transaction_rows(rows)
+    return 201, {'inserted': len(rows), 'customers': list(customer_ids)}
+
+
+def get_balances(user_id, query):
+    ids = [part for part in query.get('ids', '').split(',') if part.strip()]
+    if not ids:
+        raise ApiError(400, "Pass customer ids as ?ids=1,2,3")
+    customer_ids = owned(user_id, (parse_id(part, 'ids') for part in ids))
+    return 200, {'balances': [balance_json(row) for row in records.get_balances(user_id, customer_ids)]}
+
+
+def get_history(user_id, customer_id, query):
+    owned(user_id, [customer_id])
+    limit = max(1, min(parse_id(query.get('limit', 50), 'limit'), HISTORY_PAGE_LIMIT))
+    after = decode_cursor(query['after']) if query.get('after') else None
+    start_date, end_date = query.get('start_date'), query.get('end_date')
+    if bool(start_date) != bool(end_date):
+        raise ApiError(400, "Pass both start_date and end_date, or neither")
+    try:
+        transactions, has_more = records.get_transactions_page(customer_id, start_date, end_date, after=after, limit=limit)
+    except ValueError:
+        raise ApiError(400, "start_date and end_date must be YYYY-MM-DD")
+    return 200, {
+        'transactions': [dict(zip(ledger.COLUMNS, row))
+                         for row in transactions],
+        'next': encode_cursor(transactions.last_key()) if has_more else None,
+    }
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'RecordsAPI/1.0'
+    # Headers and body go out in separate writes; with Nagle on, keep-alive clients wait out a delayed ACK per response.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        try:
+            url = urlsplit(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            parts = [part for part in url.path.split('/') if part]
+            body = self.read_body() if method == 'POST' else None
+            status, payload = self.route(method, parts, body, query)
+        except ApiError as e:
+            status, payload = e.status, {'error': str(e), **({'errors': e.errors} if e.errors else {})}
+        except (db.PoolError, psycopg2.Error, sqlite3.Error) as e:
+            self.log_error("database error: %s", e)
+            status, payload = 503, {'error': "Database unavailable"}
+        except Exception as e:
+            self.log_error("%s failed: %r", self.path, e)
+            status, payload = 500, {'error': "Internal error"}
+        self.send_json(status, payload)
+
+    def route(self, method, parts, body, query):
+        if parts[:1] != ['api']:
+            raise ApiError(404, "Not found")
+        parts = parts[1:]
+        if parts == ['login'] and method == 'POST':
+            return login(body, query)
+        user_id = self.authenticate()
+        records.bind_session(user_session(user_id))
+        if parts == ['customers'] and method == 'GET':
+            return list_customers(user_id, query)
+        if parts == ['transactions'] and method == 'POST':
+            return post_transactions(user_id, body, query)
+        if parts == ['balances'] and method == 'GET':
+            return get_balances(user_id, query)
+        if len(parts) == 3 and parts[0] == 'customers' and parts[2] == 'transactions' and method == 'GET':
+            return get_history(user_id, parse_id(parts[1], 'customer id'), query)
+        raise ApiError(404, "Not found")
+
+    def authenticate(self):
+        header = self.headers.get('Authorization', '')
+        user_id = verify_token(header[7:]) if header.startswith('Bearer ') else None
+        if user_id is None:
+            raise ApiError(401, "Missing or expired token")
+        return user_id
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_BYTES:
+            # The body is left unread, so the connection can't be reused.
+            self.close_connection = True
+            raise ApiError(413, "Request body too large")
+        try:
+            # Amounts stay exact: JSON numbers with a fraction become Decimals, never floats.
+            return json.loads(self.rfile.read(length) or b'null', parse_float=Decimal)
+        except ValueError:
+            raise ApiError(400, "Request body is not valid JSON")
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload, default=to_json).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_request(self, code='-', size='-'):
+        # Per-request access logs cost more than the writes at terminal volumes; only failures are logged.
+        if isinstance(code, int) and code >= 500:
+            super().log_request(code, size)
+
+
+def make_server(settings, host, port):
+    global _settings
+    if not settings.get("API_SECRET"):
+        raise ValueError("Set API_SECRET in the secrets file to sign API tokens")
+    _settings = settings
+    records.configure(settings)
+    records.ensure_schema()
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    import tomllib
+    parser = argparse.ArgumentParser(description="JSON API for recording transactions without the Streamlit UI.")
+    parser.add_argument('--secrets', default=os.path.join('.streamlit', 'secrets.toml'))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8502)
+    args = parser.parse_args()
+
+    with open(args.secrets, 'rb') as f:
+        settings = tomllib.load(f)
+    server = make_server(settings, args.host, args.port)
+    print(f"serving on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,14 @@
 import streamlit as st
-import psycopg2
-from psycopg2.extras import RealDictCursor
-import hashlib
-from datetime import datetime
-import pandas as pd
-import pytz
+import csv
+import io
+import uuid
+from decimal import Decimal
+import records
+from records import (BALANCE_SORTS, CUSTOMER_SEARCH_LIMIT, EXPORT_COLUMNS, add_customer, add_transaction,
+                     add_transactions, build_export, delete_transaction, ensure_schema, get_cache,
+                     get_customer_balances, get_local_time, get_monthly_report, get_pool, get_statement_page,
+                     get_transaction, import_transactions, load_customer_page, login_user, opening_balance,
+                     parse_entry_row, register_user, search_customers, statement_cursor, update_transaction)
 
 # Page config MUST be first
 st.set_page_config(
@@ -121,70 +125,41 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-LOCAL_TIMEZONE = pytz.timezone('Asia/Karachi')
+RECORDS_VIEW = "👤 Customer Records"
+BALANCES_VIEW = "📋 All Balances"
+REPORT_VIEW = "📆 Monthly Report"
 
-def get_local_time():
-    return datetime.now(LOCAL_TIMEZONE)
+def connection_failed(error):
+    st.error(f"Database connection failed: {error}")
+    st.stop()
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            host=st.secrets["DB_HOST"],
-            database=st.secrets["DB_NAME"],
-            user=st.secrets["DB_USER"],
-            password=st.secrets["DB_PASSWORD"],
-            port=st.secrets["DB_PORT"],
-            sslmode=st.secrets["DB_SSLMODE"],
-            cursor_factory=RealDictCursor
-        )
-        return conn
-    except Exception as e:
-        st.error(f"Database connection failed: {e}")
-        st.stop()
+records.configure(st.secrets, on_connection_error=connection_failed)
 
-def hash_password(password):
-    salt = b'money_records_salt_2024'
-    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000).hex()
+def start_trace():
+    tracer = records.get_tracer()
+    previous = st.session_state.get('query_trace')
+    # st.stop() and st.rerun() end a script run early, so its trace is closed here.
+    tracer.finish(previous, interrupted=True)
+    if 'trace_session' not in st.session_state:
+        st.session_state.trace_session = uuid.uuid4().hex[:8]
+        st.session_state.trace_reruns = 0
+    st.session_state.trace_reruns += 1
+    st.session_state.previous_query_trace = previous
+    st.session_state.query_trace = tracer.start(f"{st.session_state.trace_session}-{st.session_state.trace_reruns}")
 
-def init_db():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                 id SERIAL PRIMARY KEY,
-                 name TEXT NOT NULL,
-                 email TEXT UNIQUE NOT NULL,
-                 password TEXT NOT NULL
-                 )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS customers (
-                 id SERIAL PRIMARY KEY,
-                 user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                 name TEXT NOT NULL
-                 )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS transactions (
-                 id SERIAL PRIMARY KEY,
-                 customer_id INTEGER NOT NULL REFERENCES customers(id) ON DELETE CASCADE,
-                 date_time TIMESTAMP NOT NULL,
-                 type TEXT NOT NULL CHECK (type IN ('Received', 'Given')),
-                 total_amount NUMERIC DEFAULT 0,
-                 amount_received NUMERIC DEFAULT 0,
-                 amount_left NUMERIC DEFAULT 0,
-                 note TEXT
-                 )''')
-    try:
-        c.execute("SELECT * FROM users WHERE email = %s", ('admin@example.com',))
-        if not c.fetchone():
-            hashed = hash_password('admin123')
-            c.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s)",
-                      ('Admin User', 'admin@example.com', hashed))
-            conn.commit()
-    except Exception as e:
-        conn.rollback()
-    conn.close()
+start_trace()
+
+# Remembers this session's last write so its reads skip replicas that haven't replayed it yet.
+if 'db_session' not in st.session_state:
+    st.session_state.db_session = records.new_session()
+records.bind_session(st.session_state.db_session)
 
 def init_session_state():
-    if 'db_initialized' not in st.session_state:
-        init_db()
-        st.session_state.db_initialized = True
+    try:
+        ensure_schema()
+    except records.MigrationRequired as e:
+        st.error(f"The database needs maintenance before the app can start. {e}")
+        st.stop()
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
     if 'user_id' not in st.session_state:
@@ -199,125 +174,51 @@ def init_session_state():
         st.session_state.edit_transaction_id = None
     if 'show_add_customer' not in st.session_state:
         st.session_state.show_add_customer = False
+    if 'history_page_size' not in st.session_state:
+        st.session_state.history_page_size = int(st.secrets.get("HISTORY_PAGE_SIZE", 50))
+    if 'history_key' not in st.session_state:
+        st.session_state.history_key = None
+    if 'history_cursors' not in st.session_state:
+        st.session_state.history_cursors = [None]
+    if 'history_pages' not in st.session_state:
+        st.session_state.history_pages = 1
+    if 'statement_cursors' not in st.session_state:
+        st.session_state.statement_cursors = [None]
+    if 'confirm_delete_id' not in st.session_state:
+        st.session_state.confirm_delete_id = None
+    if 'show_bulk_entry' not in st.session_state:
+        st.session_state.show_bulk_entry = False
+    if 'bulk_entry_version' not in st.session_state:
+        st.session_state.bulk_entry_version = 0
 
 init_session_state()
 
-def register_user(name, email, password):
-    try:
-        conn = get_db_connection()
-        c = conn.cursor()
-        hashed = hash_password(password)
-        c.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s) RETURNING id",
-                  (name, email, hashed))
-        result = c.fetchone()
-        user_id = result['id']
-        conn.commit()
-        conn.close()
-        return True, user_id, name
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        conn.close()
-        return False, None, None
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        return False, None, None
-
-def login_user(email, password):
-    conn = get_db_connection()
-    c = conn.cursor()
-    hashed = hash_password(password)
-    c.execute("SELECT id, name FROM users WHERE email = %s AND password = %s", (email, hashed))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return True, result['id'], result['name']
-    return False, None, None
+LIVE_REFRESH_INTERVAL = float(st.secrets.get("LIVE_REFRESH_INTERVAL", 2))
 
-def get_customers(user_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, name FROM customers WHERE user_id = %s ORDER BY name", (user_id,))
-    customers = c.fetchall()
-    conn.close()
-    return [(c['id'], c['name']) for c in customers]
+# Checks this process's change feed, not the database; the cache entries for the customer were already invalidated.
+@st.fragment(run_every=LIVE_REFRESH_INTERVAL or None)
+def watch_customer(customer_id, seen):
+    change = records.get_customer_change(customer_id)
+    if change[0] != seen[0]:
+        records.follow_change(st.session_state.db_session, change)
+        st.rerun()
 
-def add_customer(user_id, name):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO customers (user_id, name) VALUES (%s, %s)", (user_id, name))
-    conn.commit()
-    conn.close()
-
-def get_transactions(customer_id, month_filter=None, start_date=None, end_date=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    if start_date and end_date:
-        c.execute("""SELECT id, date_time, type, total_amount, amount_received, amount_left, note 
-                     FROM transactions WHERE customer_id = %s AND date_time::date BETWEEN %s AND %s
-                     ORDER BY date_time DESC""", (customer_id, start_date, end_date))
-    elif month_filter and month_filter != "All Months":
-        c.execute("""SELECT id, date_time, type, total_amount, amount_received, amount_left, note 
-                     FROM transactions WHERE customer_id = %s AND TO_CHAR(date_time, 'YYYY-MM') = %s
-                     ORDER BY date_time DESC""", (customer_id, month_filter))
-    else:
-        c.execute("""SELECT id, date_time, type, total_amount, amount_received, amount_left, note 
-                     FROM transactions WHERE customer_id = %s ORDER BY date_time DESC""", (customer_id,))
-    transactions = c.fetchall()
-    conn.close()
-    return [(t['id'], t['date_time'], t['type'], t['total_amount'], 
-             t['amount_received'], t['amount_left'], t['note']) for t in transactions]
-
-def get_today_transactions(customer_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    today = get_local_time().strftime('%Y-%m-%d')
-    c.execute("""SELECT date_time, type, total_amount FROM transactions 
-                 WHERE customer_id = %s AND date_time::date = %s ORDER BY date_time DESC""",
-              (customer_id, today))
-    transactions = c.fetchall()
-    conn.close()
-    return [(t['date_time'], t['type'], t['total_amount']) for t in transactions]
-
-def add_transaction(customer_id, trans_type, total_amount, amount_received, amount_left, note):
-    conn = get_db_connection()
-    c = conn.cursor()
-    date_time = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
-    c.execute("""INSERT INTO transactions (customer_id, date_time, type, total_amount, amount_received, amount_left, note)
-                 VALUES (%s, %s, %s, %s, %s, %s, %s)""",
-              (customer_id, date_time, trans_type, total_amount, amount_received, amount_left, note))
-    conn.commit()
-    conn.close()
-
-def update_transaction(trans_id, trans_type, total_amount, amount_received, amount_left, note):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""UPDATE transactions SET type = %s, total_amount = %s, amount_received = %s, amount_left = %s, note = %s
-                 WHERE id = %s""", (trans_type, total_amount, amount_received, amount_left, note, trans_id))
-    conn.commit()
-    conn.close()
-
-def delete_transaction(trans_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM transactions WHERE id = %s", (trans_id,))
-    conn.commit()
-    conn.close()
-
-def get_available_months(customer_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("""SELECT DISTINCT TO_CHAR(date_time, 'YYYY-MM') as month FROM transactions 
-                 WHERE customer_id = %s ORDER BY month DESC""", (customer_id,))
-    months = [row['month'] for row in c.fetchall()]
-    conn.close()
-    return months
+def render_header():
+    st.markdown('<div class="main-header">', unsafe_allow_html=True)
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        st.markdown(f"<h1 style='color: white; margin: 0;'>👋 Welcome, {st.session_state.user_name}!</h1>", unsafe_allow_html=True)
+        st.markdown("<p style='color: white; margin: 0; font-weight: 500;'>Manage your customer transactions efficiently</p>", unsafe_allow_html=True)
+    with col2:
+        if st.button("🚪 Logout", type="secondary", use_container_width=True):
+            st.session_state.clear()
+            st.rerun()
+    st.markdown('</div>', unsafe_allow_html=True)
+    st.radio("View", [RECORDS_VIEW, BALANCES_VIEW, REPORT_VIEW], horizontal=True, key="main_view", label_visibility="collapsed")
 
-def calculate_summary(transactions):
-    total_received = sum(float(t[3]) for t in transactions if t[2] == 'Received')
-    total_given = sum(float(t[3]) for t in transactions if t[2] == 'Given')
-    balance = total_received - total_given
-    return total_received, total_given, balance
+def open_customer(customer_id):
+    st.session_state.customer_select = customer_id
+    st.session_state.main_view = RECORDS_VIEW
 
 # AUTH SCREEN
 if not st.session_state.logged_in:
@@ -377,32 +278,151 @@ if not st.session_state.logged_in:
                     else:
                         st.warning("⚠️ Please fill in all fields")
 
-# CUSTOMER SCREEN
-else:
-    st.markdown('<div class="main-header">', unsafe_allow_html=True)
-    col1, col2 = st.columns([4, 1])
+# BALANCES SCREEN
+elif st.session_state.get('main_view') == BALANCES_VIEW:
+    render_header()
+    st.markdown("### 📋 Customer Balances")
+    
+    col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
     with col1:
-        st.markdown(f"<h1 style='color: white; margin: 0;'>👋 Welcome, {st.session_state.user_name}!</h1>", unsafe_allow_html=True)
-        st.markdown("<p style='color: white; margin: 0; font-weight: 500;'>Manage your customer transactions efficiently</p>", unsafe_allow_html=True)
+        balance_search = st.text_input("🔎 Filter Customers", placeholder="Type part of a customer name")
     with col2:
-        if st.button("🚪 Logout", type="secondary", use_container_width=True):
-            st.session_state.clear()
-            st.rerun()
-    st.markdown('</div>', unsafe_allow_html=True)
+        balance_sort = st.selectbox("Sort By", list(BALANCE_SORTS))
+    with col3:
+        balance_descending = st.toggle("Descending", value=balance_sort != "Name")
+    with col4:
+        pending_only = st.toggle("Pending only")
+    
+    balances = get_customer_balances(st.session_state.user_id, balance_search, balance_sort, balance_descending, pending_only)
+    if balances:
+        total_received = sum((b['received'] for b in balances), Decimal(0))
+        total_given = sum((b['given'] for b in balances), Decimal(0))
+        total_pending = sum((b['pending'] for b in balances), Decimal(0))
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric("💰 Total Received", f"₨ {total_received:,.2f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        with col2:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric("💸 Total Given", f"₨ {total_given:,.2f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        with col3:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric("📈 Net Balance", f"₨ {total_received - total_given:,.2f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        with col4:
+            st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+            st.metric("⏳ Outstanding", f"₨ {total_pending:,.2f}")
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        st.caption(f"📊 {len(balances)} customer(s)")
+        amount = st.column_config.NumberColumn(format="%.2f")
+        event = st.dataframe({
+                "Customer": [b['name'] for b in balances],
+                "Received (₨)": [float(b['received']) for b in balances],
+                "Given (₨)": [float(b['given']) for b in balances],
+                "Net (₨)": [float(b['net']) for b in balances],
+                "Pending (₨)": [float(b['pending']) for b in balances],
+                "Transactions": [b['transaction_count'] for b in balances],
+            }, column_config={"Received (₨)": amount, "Given (₨)": amount, "Net (₨)": amount, "Pending (₨)": amount},
+            key=f"balances_grid_{hash((balance_search, balance_sort, balance_descending, pending_only))}", on_select="rerun", selection_mode="single-row",
+            hide_index=True, use_container_width=True, height=min(38 + 35 * len(balances), 700))
+        if event.selection.rows:
+            selected_balance = balances[event.selection.rows[0]]
+            st.button(f"👤 Open {selected_balance['name']}", type="primary", on_click=open_customer,
+                args=(selected_balance['id'],))
+    else:
+        st.info("🔍 No customers found.")
+
+# MONTHLY REPORT SCREEN
+elif st.session_state.get('main_view') == REPORT_VIEW:
+    render_header()
+    st.markdown("### 📆 Monthly Report")
+    
+    report = get_monthly_report(st.session_state.user_id)
+    if report:
+        amount = st.column_config.NumberColumn(format="%.2f")
+        st.bar_chart({
+                "Month": [r['month'] for r in reversed(report)],
+                "Net (₨)": [float(r['net']) for r in reversed(report)],
+            }, x="Month", y="Net (₨)", color="#667eea")
+        st.caption(f"📊 {len(report)} month(s) across all customers")
+        st.dataframe({
+                "Month": [r['month'] for r in report],
+                "Received (₨)": [float(r['received']) for r in report],
+                "Given (₨)": [float(r['given']) for r in report],
+                "Net (₨)": [float(r['net']) for r in report],
+                "Pending (₨)": [float(r['pending']) for r in report],
+                "Transactions": [r['transaction_count'] for r in report],
+                "Active Customers": [r['customers'] for r in report],
+            }, column_config={"Received (₨)": amount, "Given (₨)": amount, "Net (₨)": amount, "Pending (₨)": amount},
+            hide_index=True, use_container_width=True, height=min(38 + 35 * len(report), 700))
+    else:
+        st.info("📭 No transactions recorded yet.")
+
+# CUSTOMER SCREEN
+else:
+    render_header()
+    
+    today = get_local_time().date()
+    st.session_state.selected_customer_id = st.session_state.get('customer_select')
+    customer_search = st.session_state.get('customer_search', "")
+    customer_limit = None if st.session_state.get('show_all_customers') else CUSTOMER_SEARCH_LIMIT
+    filter_type = st.session_state.get('filter_type', "Date Range")
+    start_date = None
+    end_date = None
+    if filter_type == "Date Range":
+        start_date = st.session_state.get('start_date', today.replace(day=1))
+        end_date = st.session_state.get('end_date', today)
+    invalid_range = bool(start_date and end_date and start_date > end_date)
+    if invalid_range:
+        start_date = None
+        end_date = None
+    start_str = start_date.strftime('%Y-%m-%d') if start_date else None
+    end_str = end_date.strftime('%Y-%m-%d') if end_date else None
     
-    customers = get_customers(st.session_state.user_id)
-    customer_dict = {c[1]: c[0] for c in customers}
-    customer_names = list(customer_dict.keys())
+    if st.session_state.selected_customer_id:
+        history_key = (st.session_state.selected_customer_id, start_str, end_str, st.session_state.history_page_size)
+        if st.session_state.history_key != history_key:
+            st.session_state.history_key = history_key
+            st.session_state.history_cursors = [None]
+            st.session_state.history_pages = 1
+            st.session_state.statement_cursors = [None]
+        
+        # Taken before loading, so a change that lands mid-load still triggers a refresh.
+        seen_change = records.get_customer_change(st.session_state.selected_customer_id) if LIVE_REFRESH_INTERVAL else None
+        page = load_customer_page(st.session_state.user_id, st.session_state.selected_customer_id, start_str, end_str,
+            after=st.session_state.history_cursors[-1],
+            limit=st.session_state.history_page_size * st.session_state.history_pages, today=today,
+            search=customer_search, customer_limit=customer_limit)
+        if not page.transactions and len(st.session_state.history_cursors) > 1:
+            st.session_state.history_cursors = [None]
+            st.session_state.history_pages = 1
+            st.rerun()
+        customers, customer_total, selected_name = page.customers, page.customer_total, page.customer_name
+        transactions, has_more, summary, today_trans = page.transactions, page.has_more, page.summary, page.today
+    else:
+        customers, customer_total = search_customers(st.session_state.user_id, customer_search, customer_limit)
+        selected_name = None
+    customer_names = {c[0]: c[1] for c in customers}
+    if selected_name is not None:
+        customer_names = {st.session_state.selected_customer_id: selected_name, **customer_names}
     
     col1, col2 = st.columns([3, 1])
     with col1:
-        if customer_names:
-            selected_name = st.selectbox("Select Customer", [""] + customer_names,
-                format_func=lambda x: "Please select a customer" if x == "" else x)
-            if selected_name:
-                st.session_state.selected_customer_id = customer_dict[selected_name]
-            else:
-                st.session_state.selected_customer_id = None
+        if customer_total:
+            search_col, all_col = st.columns([3, 1])
+            with search_col:
+                st.text_input("🔎 Search Customers", key="customer_search", placeholder="Type part of a customer name")
+            with all_col:
+                st.checkbox(f"Show all {customer_total} customers", key="show_all_customers")
+            if customer_search and not customers:
+                st.caption("No customers match your search")
+            selected = st.selectbox("Select Customer", [None] + list(customer_names), key="customer_select",
+                format_func=lambda x: "Please select a customer" if x is None else customer_names[x])
+            if selected != st.session_state.selected_customer_id:
+                st.rerun()
         else:
             st.info("No customers yet. Click 'Add New Customer' to get started.")
             st.session_state.selected_customer_id = None
@@ -433,58 +453,111 @@ else:
                 st.rerun()
     
     if st.session_state.selected_customer_id:
+        if seen_change is not None:
+            watch_customer(st.session_state.selected_customer_id, seen_change)
         st.markdown("---")
         st.markdown("### 🔍 Search Transactions")
         
-        filter_type = st.radio("Filter By:", ["Date Range", "All Transactions"], horizontal=True,
+        st.radio("Filter By:", ["Date Range", "All Transactions"], horizontal=True, key="filter_type",
             help="Choose how you want to view transactions")
         
-        start_date = None
-        end_date = None
-        
         if filter_type == "Date Range":
             col1, col2 = st.columns(2)
             with col1:
-                start_date = st.date_input("From Date", value=get_local_time().date().replace(day=1), help="Select start date")
+                st.date_input("From Date", value=today.replace(day=1), key="start_date", help="Select start date")
             with col2:
-                end_date = st.date_input("To Date", value=get_local_time().date(), help="Select end date")
-            if start_date > end_date:
+                st.date_input("To Date", value=today, key="end_date", help="Select end date")
+            if invalid_range:
                 st.error("❌ Start date cannot be after end date")
-                start_date = None
-                end_date = None
-        
-        transactions = get_transactions(st.session_state.selected_customer_id, None,
-            start_date.strftime('%Y-%m-%d') if start_date else None,
-            end_date.strftime('%Y-%m-%d') if end_date else None)
         
         if transactions:
-            total_received, total_given, balance = calculate_summary(transactions)
             st.markdown("### 💼 Financial Overview")
-            col1, col2, col3 = st.columns(3)
+            col1, col2, col3, col4 = st.columns(4)
             with col1:
                 st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                st.metric("💰 Total Received", f"₨ {total_received:,.2f}")
+                st.metric("💰 Total Received", f"₨ {summary.received:,.2f}")
                 st.markdown('</div>', unsafe_allow_html=True)
             with col2:
                 st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                st.metric("💸 Total Given", f"₨ {total_given:,.2f}")
+                st.metric("💸 Total Given", f"₨ {summary.given:,.2f}")
                 st.markdown('</div>', unsafe_allow_html=True)
             with col3:
                 st.markdown('<div class="metric-card">', unsafe_allow_html=True)
-                st.metric("📈 Net Balance", f"₨ {balance:,.2f}")
+                st.metric("📈 Net Balance", f"₨ {summary.balance:,.2f}")
+                st.markdown('</div>', unsafe_allow_html=True)
+            with col4:
+                st.markdown('<div class="metric-card">', unsafe_allow_html=True)
+                st.metric("⏳ Outstanding", f"₨ {summary.outstanding:,.2f}")
                 st.markdown('</div>', unsafe_allow_html=True)
             
             st.write("")
             if filter_type == "Date Range" and start_date and end_date:
-                filename = f"{selected_name}_{start_date}_{end_date}.csv"
+                filename = f"{selected_name}_{start_date}_{end_date}"
             else:
-                filename = f"{selected_name}_all_records_{get_local_time().strftime('%Y%m%d_%H%M%S')}.csv"
-            df = pd.DataFrame(transactions, columns=['ID', 'Date & Time', 'Type', 'Total Amount', 'Amount Received', 'Amount Left', 'Note'])
-            csv = df.to_csv(index=False)
-            st.download_button(label="📥 Download Records (CSV)", data=csv, file_name=filename, mime="text/csv",
-                type="secondary", use_container_width=True)
+                filename = f"{selected_name}_all_records_{get_local_time().strftime('%Y%m%d_%H%M%S')}"
+            col1, col2 = st.columns([1, 3])
+            with col1:
+                export_format = st.selectbox("Export Format", ["CSV", "Parquet", "Statement CSV"], label_visibility="collapsed")
+            with col2:
+                prepare_export = st.button(f"📥 Prepare Records ({export_format})", type="secondary", use_container_width=True)
+            if prepare_export:
+                try:
+                    data = build_export(export_format, st.session_state.selected_customer_id, start_str, end_str)
+                except ImportError:
+                    st.error("❌ Parquet export needs the pyarrow package installed")
+                else:
+                    extension, mime = ("parquet", "application/vnd.apache.parquet") if export_format == "Parquet" else ("csv", "text/csv")
+                    suffix = "_statement" if export_format == "Statement CSV" else ""
+                    st.download_button(label=f"📥 Download Records ({export_format})", data=data,
+                        file_name=f"{filename}{suffix}.{extension}", mime=mime, type="secondary", use_container_width=True)
+        
+        if page.months:
+            st.write("")
+            if st.toggle("📈 Show Monthly Trend", key="show_month_trend"):
+                st.markdown("### 📈 Monthly Trend")
+                st.bar_chart({
+                        "Month": [m.month for m in page.months],
+                        "Received (₨)": [float(m.received) for m in page.months],
+                        "Given (₨)": [float(m.given) for m in page.months],
+                    }, x="Month", y=["Received (₨)", "Given (₨)"], stack=False, color=["#2ecc71", "#e74c3c"])
+                st.caption(f"📊 All {len(page.months)} month(s) with activity, regardless of the date filter above")
+        
+        if transactions:
+            if st.toggle("🧾 Show Statement", key="show_statement"):
+                st.markdown("### 🧾 Statement")
+                range_start, _ = records.filter_bounds(start_str, end_str)
+                opening, opening_pending = opening_balance(st.session_state.selected_customer_id, range_start)
+                st.caption(f"Opening balance: ₨ {opening:,.2f} · Pending: ₨ {opening_pending:,.2f} → "
+                           f"Closing balance: ₨ {opening + summary.balance:,.2f} · "
+                           f"Pending: ₨ {opening_pending + summary.outstanding:,.2f}")
+                statement = get_statement_page(st.session_state.selected_customer_id, start_str, end_str,
+                    after=st.session_state.statement_cursors[-1], limit=st.session_state.history_page_size)
+                if not statement.transactions and len(st.session_state.statement_cursors) > 1:
+                    st.session_state.statement_cursors = [None]
+                    st.rerun()
+                st.dataframe({
+                        "Date & Time": statement.transactions.formatted_dates(),
+                        "Type": statement.transactions.type_labels("✅ Received", "❌ Given"),
+                        "Total (₨)": statement.transactions.formatted_amounts('total_amount'),
+                        "Pending (₨)": statement.transactions.formatted_amounts('amount_left'),
+                        "Balance (₨)": [f"{value:,.2f}" for value in statement.balance],
+                        "Pending Balance (₨)": [f"{value:,.2f}" for value in statement.pending],
+                        "Note": statement.transactions.formatted_notes("—"),
+                    }, hide_index=True, use_container_width=True, height=min(38 + 35 * len(statement.transactions), 600))
+                col1, col2, col3 = st.columns([1, 2, 1])
+                with col1:
+                    if st.button("⬅️ Earlier", key="statement_previous", disabled=len(st.session_state.statement_cursors) == 1,
+                                 use_container_width=True):
+                        st.session_state.statement_cursors.pop()
+                        st.rerun()
+                with col2:
+                    st.caption(f"Oldest first · Page {len(st.session_state.statement_cursors)} · "
+                               f"Brought forward: ₨ {statement.opening[0]:,.2f}")
+                with col3:
+                    if st.button("Later ➡️", key="statement_next", disabled=not statement.has_more, use_container_width=True):
+                        st.session_state.statement_cursors.append(statement_cursor(statement))
+                        st.rerun()
         
-        today_trans = get_today_transactions(st.session_state.selected_customer_id)
         if today_trans:
             st.markdown("---")
             st.markdown("### 📅 Today's Activity")
@@ -502,15 +575,112 @@ else:
         
         st.markdown("---")
         
-        if st.button("➕ Add Transaction", type="primary"):
-            st.session_state.show_add_form = True
-            st.session_state.edit_transaction_id = None
+        col1, col2, _ = st.columns([1, 1, 3])
+        with col1:
+            if st.button("➕ Add Transaction", type="primary", use_container_width=True):
+                st.session_state.show_add_form = True
+                st.session_state.show_bulk_entry = False
+                st.session_state.edit_transaction_id = None
+        with col2:
+            if st.button("📝 Bulk Entry", type="secondary", use_container_width=True):
+                st.session_state.show_bulk_entry = True
+                st.session_state.show_add_form = False
+                st.session_state.edit_transaction_id = None
+        
+        with st.expander("📤 Import Records (CSV)"):
+            st.caption("Use the same columns as the CSV download: " + ", ".join(EXPORT_COLUMNS) + ". The ID column is ignored.")
+            with st.form("import_form", clear_on_submit=True):
+                import_file = st.file_uploader("CSV File", type=["csv"])
+                run_import = st.form_submit_button("📤 Import Records", type="primary", use_container_width=True)
+            if run_import:
+                if import_file is None:
+                    st.error("❌ Please choose a CSV file")
+                else:
+                    try:
+                        imported, rejected = import_transactions(st.session_state.selected_customer_id,
+                            io.TextIOWrapper(import_file, encoding='utf-8-sig', newline=''))
+                    except records.ImportInterrupted as e:
+                        st.error(f"❌ Import stopped by a database error after {e.imported} transaction(s) were saved: {e}")
+                        if e.rejected:
+                            st.warning(f"⚠️ {len(e.rejected)} row(s) before the error were rejected")
+                            st.dataframe(e.rejected, use_container_width=True, hide_index=True)
+                    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+                        st.error(f"❌ Could not import file: {e}")
+                    else:
+                        st.session_state.import_result = (imported, rejected)
+                        st.rerun()
+            if st.session_state.get('import_result'):
+                imported, rejected = st.session_state.pop('import_result')
+                st.success(f"✅ Imported {imported} transaction(s)")
+                if rejected:
+                    st.warning(f"⚠️ {len(rejected)} row(s) were rejected")
+                    st.dataframe(rejected, use_container_width=True, hide_index=True)
+        
+        if st.session_state.get('bulk_result'):
+            saved = st.session_state.pop('bulk_result')
+            st.success(f"✅ Saved {saved} transaction(s)")
+        
+        if st.session_state.show_bulk_entry:
+            st.markdown("### 📝 Bulk Entry")
+            st.caption("Add one row per transaction and save them together. Amount Left is worked out for each row as Total - Received.")
+            import pandas as pd
+            with st.form("bulk_entry_form"):
+                entries = st.data_editor(pd.DataFrame({"Type": pd.Series(dtype="string"),
+                                                       "Total Amount": pd.Series(dtype="float64"),
+                                                       "Amount Received": pd.Series(dtype="float64"),
+                                                       "Note": pd.Series(dtype="string")}),
+                    key=f"bulk_entry_{st.session_state.bulk_entry_version}", num_rows="dynamic",
+                    hide_index=True, use_container_width=True,
+                    column_config={
+                        "Type": st.column_config.SelectboxColumn("Type", options=["Received", "Given"],
+                            default="Received", required=True),
+                        "Total Amount": st.column_config.NumberColumn("Total Amount (₨)", min_value=0.01, step=0.01,
+                            format="%.2f", required=True),
+                        "Amount Received": st.column_config.NumberColumn("Amount Received (₨)", min_value=0.0, step=0.01,
+                            format="%.2f", default=0.0),
+                        "Note": st.column_config.TextColumn("Note"),
+                    })
+                col1, col2 = st.columns(2)
+                with col1:
+                    save_bulk = st.form_submit_button("💾 Save All", type="primary", use_container_width=True)
+                with col2:
+                    cancel_bulk = st.form_submit_button("❌ Cancel", use_container_width=True)
+            
+            if save_bulk:
+                rows = entries.astype(object).where(entries.notna(), None).to_dict("records")
+                rows = [row for row in rows if any(value not in (None, "") for value in row.values())]
+                parsed = []
+                problems = []
+                for number, row in enumerate(rows, start=1):
+                    try:
+                        parsed.append(parse_entry_row(row))
+                    except ValueError as e:
+                        problems.append({"Row": number, "Reason": str(e)})
+                if not rows:
+                    st.error("❌ Add at least one row")
+                elif problems:
+                    st.error(f"❌ {len(problems)} row(s) need fixing before anything is saved")
+                    st.dataframe(problems, use_container_width=True, hide_index=True)
+                else:
+                    add_transactions(st.session_state.selected_customer_id, parsed)
+                    st.session_state.bulk_result = len(parsed)
+                    st.session_state.bulk_entry_version += 1
+                    st.session_state.show_bulk_entry = False
+                    st.rerun()
+            
+            if cancel_bulk:
+                st.session_state.bulk_entry_version += 1
+                st.session_state.show_bulk_entry = False
+                st.rerun()
         
         if st.session_state.show_add_form or st.session_state.edit_transaction_id:
             st.markdown("### " + ("✏️ Edit Transaction" if st.session_state.edit_transaction_id else "➕ Add New Transaction"))
             
             if st.session_state.edit_transaction_id:
-                trans = [t for t in transactions if t[0] == st.session_state.edit_transaction_id][0]
+                trans = transactions.get(st.session_state.edit_transaction_id) or get_transaction(st.session_state.edit_transaction_id)
+                if trans is None:
+                    st.session_state.edit_transaction_id = None
+                    st.rerun()
                 default_type = trans[2]
                 default_total_amount = float(trans[3])
                 default_amount_received = float(trans[4])
@@ -551,15 +721,20 @@ else:
                 
                 if save:
                     if total_amount > 0:
+                        saved = True
                         if st.session_state.edit_transaction_id:
-                            update_transaction(st.session_state.edit_transaction_id, trans_type, total_amount, amount_received, amount_left, note)
-                            st.success("✅ Transaction updated successfully!")
+                            saved = update_transaction(st.session_state.edit_transaction_id, trans_type, total_amount, amount_received, amount_left, note)
+                            if saved:
+                                st.success("✅ Transaction updated successfully!")
+                            else:
+                                st.error("❌ Nothing was saved: this transaction no longer exists or is in an archived month")
                         else:
                             add_transaction(st.session_state.selected_customer_id, trans_type, total_amount, amount_received, amount_left, note)
                             st.success("✅ Transaction added successfully!")
-                        st.session_state.show_add_form = False
-                        st.session_state.edit_transaction_id = None
-                        st.rerun()
+                        if saved:
+                            st.session_state.show_add_form = False
+                            st.session_state.edit_transaction_id = None
+                            st.rerun()
                     else:
                         st.error("❌ Total Amount must be greater than 0")
                 
@@ -571,63 +746,133 @@ else:
         if transactions:
             st.markdown("---")
             st.markdown("### 📜 Transaction History")
-            st.caption(f"📊 Showing {len(transactions)} transaction(s)")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                page_number = len(st.session_state.history_cursors)
+                st.caption(f"📊 Showing {len(transactions)} of {summary.count} transaction(s) · Page {page_number}")
+            with col2:
+                st.selectbox("Rows per page", sorted({25, 50, 100, 200, st.session_state.history_page_size}),
+                    key="history_page_size")
             
-            for trans in transactions:
-                trans_id, date_time, trans_type, total_amount, amount_received, amount_left, note = trans
-                
-                if isinstance(date_time, str):
-                    display_time = date_time
-                else:
-                    display_time = date_time.strftime('%Y-%m-%d %H:%M:%S')
-                
-                st.markdown('<div class="transaction-card">', unsafe_allow_html=True)
-                col1, col2, col3, col4, col5, col6, col7 = st.columns([2, 1, 1.2, 1.2, 1.2, 2.5, 0.8])
-                
+            event = st.dataframe({
+                    "Date & Time": transactions.formatted_dates(),
+                    "Type": transactions.type_labels("✅ Received", "❌ Given"),
+                    "Total (₨)": transactions.formatted_amounts('total_amount'),
+                    "Paid (₨)": transactions.formatted_amounts('amount_received'),
+                    "Pending (₨)": transactions.formatted_amounts('amount_left'),
+                    "Note": transactions.formatted_notes("—"),
+                }, key=f"history_grid_{hash(transactions.id.tobytes())}", on_select="rerun", selection_mode="single-row",
+                hide_index=True, use_container_width=True, height=min(38 + 35 * len(transactions), 600))
+            
+            if event.selection.rows:
+                trans_id = int(transactions.id[event.selection.rows[0]])
+                archived = transactions.is_archived(trans_id)
+                if archived:
+                    st.caption("🗄️ This entry is in an archived month and can't be edited or deleted")
+                col1, col2 = st.columns(2)
                 with col1:
-                    st.markdown(f"**📅 {display_time}**")
+                    if st.button("✏️ Edit Selected", disabled=archived, use_container_width=True):
+                        st.session_state.edit_transaction_id = trans_id
+                        st.session_state.show_add_form = False
+                        st.rerun()
                 with col2:
-                    if trans_type == "Received":
-                        st.success("✅ Received")
-                    else:
-                        st.error("❌ Given")
-                with col3:
-                    st.markdown(f"**Total:** ₨ {float(total_amount):,.2f}")
-                with col4:
-                    st.write(f"Paid: ₨ {float(amount_received):,.2f}")
-                with col5:
-                    st.write(f"Pending: ₨ {float(amount_left):,.2f}")
-                with col6:
-                    st.write(note if note else "—")
-                with col7:
-                    btn_col1, btn_col2 = st.columns(2)
-                    with btn_col1:
-                        if st.button("✏️", key=f"edit_{trans_id}", help="Edit"):
-                            st.session_state.edit_transaction_id = trans_id
-                            st.session_state.show_add_form = False
-                            st.rerun()
-                    with btn_col2:
-                        if st.button("🗑️", key=f"del_{trans_id}", help="Delete"):
-                            st.session_state[f'confirm_delete_{trans_id}'] = True
-                            st.rerun()
+                    if st.button("🗑️ Delete Selected", disabled=archived, use_container_width=True):
+                        st.session_state.confirm_delete_id = trans_id
+                        st.rerun()
                 
-                if st.session_state.get(f'confirm_delete_{trans_id}', False):
+                if st.session_state.confirm_delete_id == trans_id:
                     st.warning("⚠️ **Confirm Deletion** - This action cannot be undone!")
                     conf_col1, conf_col2 = st.columns(2)
                     with conf_col1:
-                        if st.button("✅ Yes, Delete", key=f"confirm_yes_{trans_id}", type="primary", use_container_width=True):
-                            delete_transaction(trans_id)
-                            st.session_state[f'confirm_delete_{trans_id}'] = False
-                            st.success("✅ Transaction deleted successfully!")
-                            st.rerun()
+                        if st.button("✅ Yes, Delete", type="primary", use_container_width=True):
+                            st.session_state.confirm_delete_id = None
+                            if delete_transaction(trans_id):
+                                st.success("✅ Transaction deleted successfully!")
+                                st.rerun()
+                            st.error("❌ Nothing was deleted: this transaction no longer exists or is in an archived month")
                     with conf_col2:
-                        if st.button("❌ Cancel", key=f"confirm_no_{trans_id}", use_container_width=True):
-                            st.session_state[f'confirm_delete_{trans_id}'] = False
+                        if st.button("❌ Cancel", use_container_width=True):
+                            st.session_state.confirm_delete_id = None
                             st.rerun()
-                
-                st.markdown('</div>', unsafe_allow_html=True)
+            else:
+                st.caption("👆 Select a row to edit or delete it")
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("⬅️ Previous", disabled=len(st.session_state.history_cursors) == 1, use_container_width=True):
+                    st.session_state.history_cursors.pop()
+                    st.session_state.history_pages = 1
+                    st.rerun()
+            with col2:
+                if st.button("⬇️ Load More", disabled=not has_more, use_container_width=True):
+                    st.session_state.history_pages += 1
+                    st.rerun()
+            with col3:
+                if st.button("Next ➡️", disabled=not has_more, use_container_width=True):
+                    st.session_state.history_cursors.append(transactions.last_key())
+                    st.session_state.history_pages = 1
+                    st.rerun()
         else:
             st.info("🔍 No transactions found. Click 'Add Transaction' to record your first entry!")
     else:
-        if customer_names:
+        if customer_total:
             st.info("👆 Please select a customer to view and manage their records.")
+
+if st.secrets.get("SHOW_DB_STATS", False):
+    with st.sidebar:
+        st.markdown("### 🔌 Connection Pool")
+        stats = get_pool().stats()
+        st.write(f"In use: {stats['in_use']} / {stats['maxconn']} (idle {stats['idle']})")
+        st.write(f"Checkouts: {stats['checkouts']} · Waits: {stats['waits']} · Timeouts: {stats['timeouts']}")
+        st.write(f"Avg wait: {stats['avg_wait_ms']:.1f} ms")
+        st.write(f"Connects: {stats['connects']} · Reconnects: {stats['reconnects']}")
+        st.write(f"Avg connect: {stats['avg_connect_ms']:.1f} ms")
+        router = records.get_router()
+        if router:
+            st.markdown("### 🔀 Read Routing")
+            stats = router.stats()
+            st.write(f"Replica reads: {stats['replica_reads']} · Primary fallbacks: own write {stats['own_write_fallbacks']}, "
+                     f"lag {stats['lag_fallbacks']}, unavailable {stats['unavailable_fallbacks']}")
+            for replica in stats['replicas']:
+                lag = "unknown" if replica['lag_s'] is None else f"{replica['lag_s']:.1f}s"
+                st.write(f"`{replica['name']}` · Lag: {lag}{' · down' if replica['down'] else ''}")
+        listener = records.get_change_listener()
+        if listener:
+            st.markdown("### 📡 Live Updates")
+            stats = listener.stats()
+            st.write(f"Listener: {'connected' if stats['connected'] else 'reconnecting'} · Reconnects: {stats['reconnects']}")
+            st.write(f"Notifications: {stats['notifications']} · Customers refreshed: {stats['customers_changed']}")
+        st.markdown("### 🗃️ Read Cache")
+        stats = get_cache().stats()
+        st.write(f"Entries: {stats['size']} / {stats['maxsize']} · TTL {stats['ttl']:.0f}s")
+        st.write(f"Hits: {stats['hits']} · Misses: {stats['misses']} · Hit rate: {stats['hit_rate']:.0%}")
+        st.write(f"Evictions: {stats['evictions']} · Expired: {stats['expirations']} · Invalidations: {stats['invalidations']}")
+
+def render_trace_panel(trace, previous):
+    summary = trace.summary()
+    st.markdown("### 🐢 Query Trace")
+    st.write(f"Rerun `{summary['rerun_id']}` · Script: {summary['script_ms']:.0f} ms · DB: {summary['db_ms']:.1f} ms")
+    st.write(f"Queries: {summary['queries']} · Slow: {summary['slow_queries']} · "
+             f"Checkouts: {summary['checkouts']} ({summary['checkout_ms']:.1f} ms)")
+    if previous is not None:
+        last = previous.summary()
+        st.caption(f"Previous rerun: {last['script_ms']:.0f} ms, {last['queries']} queries, {last['db_ms']:.1f} ms in DB"
+                   + (" (stopped early)" if last['interrupted'] else ""))
+    if trace.queries:
+        st.dataframe({
+            "#": [q['seq'] for q in trace.queries],
+            "Execute ms": [round(q['execute_ms'], 2) for q in trace.queries],
+            "Fetch ms": [round(q['fetch_ms'], 2) for q in trace.queries],
+            "Rows": [q['rows'] for q in trace.queries],
+            "SQL": [q['sql'] for q in trace.queries],
+        }, hide_index=True, use_container_width=True)
+    for q in trace.queries:
+        if q['explain']:
+            with st.expander(f"EXPLAIN #{q['seq']} · {q['execute_ms'] + q['fetch_ms']:.0f} ms"):
+                st.code(q['explain'], language=None)
+
+trace = st.session_state.get('query_trace')
+if trace is not None:
+    with st.sidebar:
+        render_trace_panel(trace, st.session_state.get('previous_query_trace'))
+    records.get_tracer().finish(trace)
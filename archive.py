@@ -0,0 +1,296 @@
+import argparse
+import os
+import re
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby
+
+from psycopg2.extras import execute_values
+
+import backends
+import records
+
+COLUMNS = ('id', 'customer_id', 'date_time', 'type', 'total_amount', 'amount_received', 'amount_left', 'note')
+AMOUNT_COLUMNS = ('total_amount', 'amount_received', 'amount_left')
+SCALE_COLUMNS = tuple(f'{column}_scale' for column in AMOUNT_COLUMNS)
+AMOUNT_SCALE = 6
+CENT = Decimal('0.01')
+ARCHIVE_BATCH_SIZE = 50000
+PARTITION_NAME = re.compile(rf'^{backends.PARTITION_PREFIX}(\d{{6}})$')
+
+
+def archive_schema():
+    import pyarrow as pa
+    amount = pa.decimal128(38, AMOUNT_SCALE)
+    # The scale columns keep each amount's scale in Postgres (993 vs 993.50), which the fixed-scale decimals lose.
+    return pa.schema([('id', pa.int64()), ('customer_id', pa.int64()), ('date_time', pa.timestamp('us')),
+                      ('type', pa.string()), ('total_amount', amount), ('amount_received', amount),
+                      ('amount_left', amount), ('note', pa.string()),
+                      *((column, pa.int8()) for column in SCALE_COLUMNS)])
+
+
+def plain(value):
+    # Parquet keeps every amount at a fixed scale; trim the padding back to cents (100.500000 -> 100.50).
+    if value is None:
+        return None
+    cents = value.quantize(CENT)
+    return cents if cents == value else value.normalize()
+
+
+def restore(value, scale):
+    # Gives an amount back the scale it had when live, so exports don't change when a month is archived.
+    # Files written before the scale columns existed have none, and fall back to plain().
+    if value is None:
+        return None
+    if scale is None:
+        return plain(value)
+    return value.quantize(Decimal(1).scaleb(-scale))
+
+
+def scan(paths, customer_id, start=None, end=None, after=None, columns=None, ascending=False):
+    import pyarrow.dataset as ds
+    condition = ds.field('customer_id') == customer_id
+    if start is not None:
+        condition &= ds.field('date_time') >= start
+    if end is not None:
+        condition &= ds.field('date_time') < end
+    if after:
+        after_time, after_id = after
+        if ascending:
+            condition &= (ds.field('date_time') > after_time) | ((ds.field('date_time') == after_time) & (ds.field('id') > after_id))
+        else:
+            condition &= (ds.field('date_time') < after_time) | ((ds.field('date_time') == after_time) & (ds.field('id') < after_id))
+    dataset = ds.dataset(paths, schema=archive_schema(), format='parquet')
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def month_groups(paths, ascending=False):
+    # Paths come newest month first; a month re-archived after a late import has more than one file.
+    groups = [list(group) for _, group in groupby(paths, key=lambda path: os.path.basename(path).rsplit('_', 1)[0])]
+    return groups[::-1] if ascending else groups
+
+
+def read_rows(paths, customer_id, start=None, end=None, after=None, limit=None, ascending=False):
+    # Months never overlap, so rows come out in order one month at a time and reading stops once limit rows are out.
+    columns = [*(column for column in COLUMNS if column != 'customer_id'), *SCALE_COLUMNS]
+    order = 'ascending' if ascending else 'descending'
+    remaining = limit
+    for group in month_groups(paths, ascending):
+        table = scan(group, customer_id, start, end, after, columns, ascending).sort_by([('date_time', order), ('id', order)])
+        for batch in table.to_batches(max_chunksize=1024):
+            rows = batch.to_pylist()
+            if remaining is not None:
+                rows = rows[:remaining]
+                remaining -= len(rows)
+            for row in rows:
+                for column, scale in zip(AMOUNT_COLUMNS, SCALE_COLUMNS):
+                    row[column] = restore(row[column], row.pop(scale))
+                row['archived'] = True
+                yield row
+            if remaining == 0:
+                return
+
+
+def total(values, scales):
+    # Like SUM() in Postgres: the scale of the widest amount summed, and 0 (via COALESCE) when there is none.
+    import pyarrow.compute as pc
+    value = pc.sum(values).as_py()
+    return Decimal(0) if value is None else restore(value, pc.max(scales).as_py())
+
+
+def summarize(paths, customer_id, start=None, end=None):
+    import pyarrow.compute as pc
+    table = scan(paths, customer_id, start, end,
+                 columns=['type', 'total_amount', 'amount_left', 'total_amount_scale', 'amount_left_scale'])
+    received = pc.equal(table['type'], 'Received')
+    given = pc.equal(table['type'], 'Given')
+    return (total(pc.filter(table['total_amount'], received), pc.filter(table['total_amount_scale'], received)),
+            total(pc.filter(table['total_amount'], given), pc.filter(table['total_amount_scale'], given)),
+            total(table['amount_left'], table['amount_left_scale']), table.num_rows)
+
+
+def month_totals(paths):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    table = ds.dataset(paths, schema=archive_schema(), format='parquet').to_table(
+        columns=['customer_id', 'date_time', 'type', 'total_amount', 'amount_left', 'total_amount_scale',
+                 'amount_left_scale'])
+    received = pc.equal(table['type'], 'Received')
+    given = pc.equal(table['type'], 'Given')
+
+    def only(condition, column):
+        return pc.if_else(condition, table[column], pa.scalar(None, type=table.schema.field(column).type))
+
+    table = pa.table({
+        'customer_id': table['customer_id'],
+        'month': pc.strftime(table['date_time'], format='%Y-%m-01'),
+        'received': only(received, 'total_amount'),
+        'received_scale': only(received, 'total_amount_scale'),
+        'given': only(given, 'total_amount'),
+        'given_scale': only(given, 'total_amount_scale'),
+        'pending': table['amount_left'],
+        'pending_scale': table['amount_left_scale'],
+    })
+    totals = table.group_by(['customer_id', 'month']).aggregate(
+        [*((column, 'sum') for column in ('received', 'given', 'pending')),
+         *((f'{column}_scale', 'max') for column in ('received', 'given', 'pending')), ('customer_id', 'count')])
+
+    def summed(row, column):
+        value = row[f'{column}_sum']
+        return Decimal(0) if value is None else restore(value, row[f'{column}_scale_max'])
+
+    return [(row['customer_id'], row['month'], summed(row, 'received'), summed(row, 'given'), summed(row, 'pending'),
+             row['customer_id_count']) for row in totals.to_pylist()]
+
+
+def rebuild_rollup():
+    # Recounts customer_months from live rows plus every archived file, e.g. for months archived before the rollup existed.
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("LOCK TABLE transactions IN SHARE MODE")
+        c.execute("SELECT path FROM transaction_archive")
+        paths = [os.path.join(records.archive_dir(), row['path']) for row in c.fetchall()]
+        c.execute("DELETE FROM customer_months")
+        c.execute(backends.MONTH_UPSERT.format(
+            rows="SELECT customer_id, date_time, type, total_amount, amount_left, 1 AS sign FROM transactions"))
+        if paths:
+            execute_values(c, """INSERT INTO customer_months AS m (customer_id, month, received, given, pending, transaction_count)
+                                 VALUES %s
+                                 ON CONFLICT (customer_id, month) DO UPDATE SET received = m.received + EXCLUDED.received,
+                                     given = m.given + EXCLUDED.given, pending = m.pending + EXCLUDED.pending,
+                                     transaction_count = m.transaction_count + EXCLUDED.transaction_count""",
+                           month_totals(paths), template="(%s, %s::date, %s, %s, %s, %s)", page_size=1000)
+        conn.commit()
+    records.get_cache().clear()
+
+
+def write_partition(conn, name, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = archive_schema()
+    c = conn.cursor(name='archive_partition')
+    c.itersize = ARCHIVE_BATCH_SIZE
+    # Sorted by customer so each row group covers few customers and reads can skip the rest.
+    c.execute(f"""SELECT id, customer_id, date_time, type, ROUND(total_amount, {AMOUNT_SCALE}) AS total_amount,
+                         ROUND(amount_received, {AMOUNT_SCALE}) AS amount_received,
+                         ROUND(amount_left, {AMOUNT_SCALE}) AS amount_left, note,
+                         {', '.join(f"LEAST(scale({column}), {AMOUNT_SCALE}) AS {column}_scale"
+                                    for column in AMOUNT_COLUMNS)}
+                  FROM {name} ORDER BY customer_id, date_time DESC, id DESC""")
+    count = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        while True:
+            rows = c.fetchmany(ARCHIVE_BATCH_SIZE)
+            if not rows:
+                break
+            writer.write_batch(pa.RecordBatch.from_pylist(rows, schema=schema))
+            count += len(rows)
+    c.close()
+    with open(path, 'rb') as f:
+        os.fsync(f.fileno())
+    return count
+
+
+def partition_fingerprint(c, name):
+    c.execute(f"SELECT COUNT(*) AS count, COALESCE(SUM(hashtext(t::text)::bigint), 0) AS digest FROM {name} t")
+    row = c.fetchone()
+    return row['count'], row['digest']
+
+
+def archive_partition(name, month, directory):
+    os.makedirs(directory, exist_ok=True)
+    file_name = f"{name}_{datetime.now():%Y%m%d%H%M%S}.parquet"
+    path = os.path.join(directory, file_name)
+    partial = path + '.tmp'
+    try:
+        with records.get_db_connection() as conn:
+            c = conn.cursor()
+            # The copy runs without blocking anyone, from one snapshot that the fingerprint also describes.
+            c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+            copied = partition_fingerprint(c, name)
+            count = write_partition(conn, name, partial)
+            conn.commit()
+            # Writers lock the parent before the partition, so the parent is locked first here too: holding the
+            # partition while DETACH waits for the parent would deadlock with an insert into this month.
+            c.execute("LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE")
+            if partition_fingerprint(c, name) != copied:
+                count = write_partition(conn, name, partial)
+            if count:
+                os.replace(partial, path)
+                c.execute("INSERT INTO transaction_archive (path, month, row_count) VALUES (%s, %s, %s)",
+                          (file_name, month.date(), count))
+            else:
+                os.remove(partial)
+            c.execute(f"ALTER TABLE transactions DETACH PARTITION {name}")
+            c.execute(f"DROP TABLE {name}")
+            conn.commit()
+    except BaseException:
+        for leftover in (partial, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    return (file_name if count else None), count
+
+
+def archive_partitions(horizon_months):
+    if not records.get_backend().archives:
+        raise ValueError("Archiving needs the Postgres backend")
+    if horizon_months < 1:
+        raise ValueError("The archive horizon must be at least one month")
+    # Reads resolve file names against ARCHIVE_DIR, so files are always written there.
+    directory = records.archive_dir()
+    cutoff = records.add_months(records.month_start(records.get_local_time()), -horizon_months)
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT child.relname AS name FROM pg_inherits
+                     JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                     WHERE pg_inherits.inhparent = 'transactions'::regclass ORDER BY child.relname""")
+        names = [row['name'] for row in c.fetchall()]
+        conn.rollback()
+    archived = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if not match:
+            continue
+        month = datetime.strptime(match.group(1), '%Y%m')
+        if month < cutoff:
+            archived.append((month, *archive_partition(name, month, directory)))
+    return archived
+
+
+def main():
+    import tomllib
+    parser = argparse.ArgumentParser(description="Move transaction partitions older than the horizon to Parquet files.")
+    parser.add_argument('--secrets', default=os.path.join('.streamlit', 'secrets.toml'))
+    parser.add_argument('--horizon-months', type=int, help="keep this many months live (default ARCHIVE_HORIZON_MONTHS or 24)")
+    parser.add_argument('--rebuild-rollup', action='store_true',
+                        help="recount the monthly rollup from live and archived rows instead of archiving")
+    parser.add_argument('--migrate', action='store_true',
+                        help="apply pending schema migrations, including those that rewrite the transactions table and "
+                             "lock it until they finish; stop the app and the API first")
+    args = parser.parse_args()
+
+    with open(args.secrets, 'rb') as f:
+        settings = tomllib.load(f)
+    records.configure(settings)
+    if args.migrate:
+        records.init_db(maintenance=True)
+        records.ensure_schema()
+        print("schema is up to date")
+        return
+    records.ensure_schema()
+    if args.rebuild_rollup:
+        rebuild_rollup()
+        print("monthly rollup rebuilt")
+        return
+    horizon = args.horizon_months or int(settings.get("ARCHIVE_HORIZON_MONTHS", 24))
+    archived = archive_partitions(horizon)
+    for month, file_name, count in archived:
+        print(f"{month:%Y-%m}: {count} rows -> {file_name or 'empty, dropped'}")
+    if not archived:
+        print(f"nothing older than {horizon} months to archive")
+
+
+if __name__ == '__main__':
+    main()
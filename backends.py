@@ -0,0 +1,612 @@
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from psycopg2.extras import execute_values
+
+import changes
+import db
+import queries
+import routing
+import sqlite_db
+import tracing
+
+
+BALANCE_UPSERT = """
+    INSERT INTO customer_balances AS b (customer_id, received, given, pending, transaction_count)
+    SELECT customer_id,
+           COALESCE(SUM(sign * total_amount) FILTER (WHERE type = 'Received'), 0),
+           COALESCE(SUM(sign * total_amount) FILTER (WHERE type = 'Given'), 0),
+           COALESCE(SUM(sign * amount_left), 0),
+           SUM(sign)
+    FROM ({rows}) delta
+    GROUP BY customer_id
+    ON CONFLICT (customer_id) DO UPDATE SET received = b.received + EXCLUDED.received,
+                                            given = b.given + EXCLUDED.given,
+                                            pending = b.pending + EXCLUDED.pending,
+                                            transaction_count = b.transaction_count + EXCLUDED.transaction_count"""
+MONTH_UPSERT = """
+    INSERT INTO customer_months AS m (customer_id, month, received, given, pending, transaction_count)
+    SELECT customer_id, date_trunc('month', date_time)::date,
+           COALESCE(SUM(sign * total_amount) FILTER (WHERE type = 'Received'), 0),
+           COALESCE(SUM(sign * total_amount) FILTER (WHERE type = 'Given'), 0),
+           COALESCE(SUM(sign * amount_left), 0),
+           SUM(sign)
+    FROM ({rows}) delta
+    GROUP BY customer_id, date_trunc('month', date_time)::date
+    ON CONFLICT (customer_id, month) DO UPDATE SET received = m.received + EXCLUDED.received,
+                                                   given = m.given + EXCLUDED.given,
+                                                   pending = m.pending + EXCLUDED.pending,
+                                                   transaction_count = m.transaction_count + EXCLUDED.transaction_count"""
+NEW_ROWS = "SELECT customer_id, date_time, type, total_amount, amount_left, 1 AS sign FROM new_rows"
+OLD_ROWS = "SELECT customer_id, date_time, type, total_amount, amount_left, -1 AS sign FROM old_rows"
+PARTITION_PREFIX = "transactions_p"
+
+
+def balance_function(*upserts):
+    def apply(rows):
+        return ";\n".join(upsert.format(rows=rows) for upsert in upserts)
+    return f"""CREATE OR REPLACE FUNCTION apply_customer_balances() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                {apply(NEW_ROWS)};
+            ELSIF TG_OP = 'DELETE' THEN
+                {apply(OLD_ROWS)};
+            ELSE
+                {apply(NEW_ROWS + " UNION ALL " + OLD_ROWS)};
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql"""
+
+
+BALANCE_TRIGGERS = [
+    """CREATE TRIGGER transactions_balances_insert AFTER INSERT ON transactions
+       REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_customer_balances()""",
+    """CREATE TRIGGER transactions_balances_update AFTER UPDATE ON transactions
+       REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_customer_balances()""",
+    """CREATE TRIGGER transactions_balances_delete AFTER DELETE ON transactions
+       REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION apply_customer_balances()""",
+]
+
+
+# One notification per changed customer; Postgres delivers them on commit and folds duplicates within a transaction.
+NOTIFY_FUNCTION = f"""CREATE OR REPLACE FUNCTION notify_transaction_changes() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            PERFORM pg_notify('{changes.CHANNEL}', customer_id::text) FROM (SELECT DISTINCT customer_id FROM new_rows) c;
+        ELSIF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('{changes.CHANNEL}', customer_id::text) FROM (SELECT DISTINCT customer_id FROM old_rows) c;
+        ELSE
+            PERFORM pg_notify('{changes.CHANNEL}', customer_id::text)
+            FROM (SELECT customer_id FROM new_rows UNION SELECT customer_id FROM old_rows) c;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql"""
+
+
+NOTIFY_TRIGGERS = [
+    """CREATE TRIGGER transactions_notify_insert AFTER INSERT ON transactions
+       REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_transaction_changes()""",
+    """CREATE TRIGGER transactions_notify_update AFTER UPDATE ON transactions
+       REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_transaction_changes()""",
+    """CREATE TRIGGER transactions_notify_delete AFTER DELETE ON transactions
+       REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION notify_transaction_changes()""",
+]
+
+
+# Creates any missing monthly partitions; the lock keeps concurrent callers from racing on the same name.
+PARTITION_FUNCTION = f"""CREATE OR REPLACE FUNCTION ensure_transaction_partitions(months DATE[]) RETURNS void AS $$
+    DECLARE
+        month DATE;
+    BEGIN
+        PERFORM pg_advisory_xact_lock(hashtext('transaction_partitions'));
+        FOREACH month IN ARRAY months LOOP
+            month := date_trunc('month', month);
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF transactions FOR VALUES FROM (%L) TO (%L)',
+                           '{PARTITION_PREFIX}' || to_char(month, 'YYYYMM'), month, month + interval '1 month');
+        END LOOP;
+    END
+    $$ LANGUAGE plpgsql"""
+
+
+MIGRATIONS = [
+    (1, [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_customer_date ON transactions (customer_id, date_time DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_customers_user_name ON customers (user_id, name)",
+    ]),
+    (2, [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_customer_date_id ON transactions (customer_id, date_time DESC, id DESC)",
+        "DROP INDEX IF EXISTS idx_transactions_customer_date",
+    ]),
+    (3, [
+        """ALTER TABLE users ADD COLUMN IF NOT EXISTS password_algorithm TEXT,
+                          ADD COLUMN IF NOT EXISTS password_iterations INTEGER,
+                          ADD COLUMN IF NOT EXISTS password_salt TEXT""",
+    ]),
+    (4, [
+        """DO $$
+           BEGIN
+               IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+                   CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                   CREATE INDEX IF NOT EXISTS idx_customers_name_trgm ON customers USING gin (name gin_trgm_ops);
+               END IF;
+           END
+           $$""",
+    ]),
+    (5, [
+        "LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE",
+        """CREATE TABLE IF NOT EXISTS customer_balances (
+               customer_id INTEGER PRIMARY KEY,
+               received NUMERIC NOT NULL DEFAULT 0,
+               given NUMERIC NOT NULL DEFAULT 0,
+               pending NUMERIC NOT NULL DEFAULT 0,
+               transaction_count BIGINT NOT NULL DEFAULT 0
+           )""",
+        balance_function(BALANCE_UPSERT),
+        *BALANCE_TRIGGERS,
+        BALANCE_UPSERT.format(rows="SELECT customer_id, type, total_amount, amount_left, 1 AS sign FROM transactions"),
+    ]),
+    (6, [
+        "LOCK TABLE transactions IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE transactions RENAME TO transactions_unpartitioned",
+        "ALTER INDEX transactions_pkey RENAME TO transactions_unpartitioned_pkey",
+        "ALTER INDEX idx_transactions_customer_date_id RENAME TO idx_transactions_unpartitioned_customer_date_id",
+        "ALTER SEQUENCE transactions_id_seq OWNED BY NONE",
+        """CREATE TABLE transactions (
+               id INTEGER NOT NULL DEFAULT nextval('transactions_id_seq'),
+               customer_id INTEGER NOT NULL REFERENCES customers(id) ON DELETE CASCADE,
+               date_time TIMESTAMP NOT NULL,
+               type TEXT NOT NULL CHECK (type IN ('Received', 'Given')),
+               total_amount NUMERIC DEFAULT 0,
+               amount_received NUMERIC DEFAULT 0,
+               amount_left NUMERIC DEFAULT 0,
+               note TEXT,
+               PRIMARY KEY (id, date_time)
+           ) PARTITION BY RANGE (date_time)""",
+        PARTITION_FUNCTION,
+        """SELECT ensure_transaction_partitions(ARRAY(
+               SELECT DISTINCT date_trunc('month', date_time)::date FROM transactions_unpartitioned
+               UNION
+               SELECT generate_series(date_trunc('month', now()), date_trunc('month', now()) + interval '3 months',
+                                      interval '1 month')::date))""",
+        # The balance triggers are created after the copy, so customer_balances stays as it is.
+        """INSERT INTO transactions (id, customer_id, date_time, type, total_amount, amount_received, amount_left, note)
+           SELECT id, customer_id, date_time, type, total_amount, amount_received, amount_left, note
+           FROM transactions_unpartitioned""",
+        "DROP TABLE transactions_unpartitioned",
+        "ALTER SEQUENCE transactions_id_seq OWNED BY transactions.id",
+        "CREATE INDEX idx_transactions_customer_date_id ON transactions (customer_id, date_time DESC, id DESC)",
+        *BALANCE_TRIGGERS,
+        """CREATE TABLE transaction_archive (
+               path TEXT PRIMARY KEY,
+               month DATE NOT NULL,
+               row_count BIGINT NOT NULL,
+               archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+           )""",
+    ]),
+    (7, [
+        "LOCK TABLE transactions IN SHARE ROW EXCLUSIVE MODE",
+        """CREATE TABLE IF NOT EXISTS customer_months (
+               customer_id INTEGER NOT NULL,
+               month DATE NOT NULL,
+               received NUMERIC NOT NULL DEFAULT 0,
+               given NUMERIC NOT NULL DEFAULT 0,
+               pending NUMERIC NOT NULL DEFAULT 0,
+               transaction_count BIGINT NOT NULL DEFAULT 0,
+               PRIMARY KEY (customer_id, month)
+           )""",
+        balance_function(BALANCE_UPSERT, MONTH_UPSERT),
+        MONTH_UPSERT.format(rows="SELECT customer_id, date_time, type, total_amount, amount_left, 1 AS sign FROM transactions"),
+    ]),
+    (8, [
+        NOTIFY_FUNCTION,
+        *NOTIFY_TRIGGERS,
+    ]),
+]
+
+# These rewrite every transaction under an exclusive lock, so on a populated ledger they only run from
+# `python archive.py --migrate`; startup stops at them instead.
+MAINTENANCE_MIGRATIONS = {6}
+
+
+def sqlite_balance_upsert(row, sign):
+    return f"""INSERT INTO customer_balances (customer_id, received, given, pending, transaction_count)
+               VALUES ({row}.customer_id,
+                       CASE WHEN {row}.type = 'Received' THEN {sign}{row}.total_amount ELSE 0 END,
+                       CASE WHEN {row}.type = 'Given' THEN {sign}{row}.total_amount ELSE 0 END,
+                       {sign}{row}.amount_left, {sign}1)
+               ON CONFLICT (customer_id) DO UPDATE SET received = received + excluded.received,
+                                                       given = given + excluded.given,
+                                                       pending = pending + excluded.pending,
+                                                       transaction_count = transaction_count + excluded.transaction_count;"""
+
+
+def sqlite_month_upsert(row, sign):
+    return f"""INSERT INTO customer_months (customer_id, month, received, given, pending, transaction_count)
+               VALUES ({row}.customer_id, strftime('%Y-%m-01', {row}.date_time),
+                       CASE WHEN {row}.type = 'Received' THEN {sign}{row}.total_amount ELSE 0 END,
+                       CASE WHEN {row}.type = 'Given' THEN {sign}{row}.total_amount ELSE 0 END,
+                       {sign}{row}.amount_left, {sign}1)
+               ON CONFLICT (customer_id, month) DO UPDATE SET received = received + excluded.received,
+                                                              given = given + excluded.given,
+                                                              pending = pending + excluded.pending,
+                                                              transaction_count = transaction_count + excluded.transaction_count;"""
+
+
+def sqlite_rollup_upserts(row, sign):
+    return sqlite_balance_upsert(row, sign) + " " + sqlite_month_upsert(row, sign)
+
+
+# SQLite databases start at the current schema, so they have their own migration history.
+SQLITE_MIGRATIONS = [
+    (1, [
+        """CREATE TABLE IF NOT EXISTS users (
+               id INTEGER PRIMARY KEY,
+               name TEXT NOT NULL,
+               email TEXT UNIQUE NOT NULL,
+               password TEXT NOT NULL,
+               password_algorithm TEXT,
+               password_iterations INTEGER,
+               password_salt TEXT
+           )""",
+        """CREATE TABLE IF NOT EXISTS customers (
+               id INTEGER PRIMARY KEY,
+               user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+               name TEXT NOT NULL
+           )""",
+        """CREATE TABLE IF NOT EXISTS transactions (
+               id INTEGER PRIMARY KEY,
+               customer_id INTEGER NOT NULL REFERENCES customers(id) ON DELETE CASCADE,
+               date_time TIMESTAMP NOT NULL,
+               type TEXT NOT NULL CHECK (type IN ('Received', 'Given')),
+               total_amount NUMERIC DEFAULT 0,
+               amount_received NUMERIC DEFAULT 0,
+               amount_left NUMERIC DEFAULT 0,
+               note TEXT
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_customer_date_id ON transactions (customer_id, date_time DESC, id DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_customers_user_name ON customers (user_id, name)",
+        """CREATE TABLE IF NOT EXISTS customer_balances (
+               customer_id INTEGER PRIMARY KEY,
+               received NUMERIC NOT NULL DEFAULT 0,
+               given NUMERIC NOT NULL DEFAULT 0,
+               pending NUMERIC NOT NULL DEFAULT 0,
+               transaction_count INTEGER NOT NULL DEFAULT 0
+           )""",
+        f"""CREATE TRIGGER IF NOT EXISTS transactions_balances_insert AFTER INSERT ON transactions
+            BEGIN {sqlite_balance_upsert('NEW', '')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS transactions_balances_update AFTER UPDATE ON transactions
+            BEGIN {sqlite_balance_upsert('OLD', '-')} {sqlite_balance_upsert('NEW', '')} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS transactions_balances_delete AFTER DELETE ON transactions
+            BEGIN {sqlite_balance_upsert('OLD', '-')} END""",
+    ]),
+    (2, [
+        """CREATE TABLE IF NOT EXISTS customer_months (
+               customer_id INTEGER NOT NULL,
+               month DATE NOT NULL,
+               received NUMERIC NOT NULL DEFAULT 0,
+               given NUMERIC NOT NULL DEFAULT 0,
+               pending NUMERIC NOT NULL DEFAULT 0,
+               transaction_count INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (customer_id, month)
+           )""",
+        "DROP TRIGGER IF EXISTS transactions_balances_insert",
+        "DROP TRIGGER IF EXISTS transactions_balances_update",
+        "DROP TRIGGER IF EXISTS transactions_balances_delete",
+        f"""CREATE TRIGGER transactions_balances_insert AFTER INSERT ON transactions
+            BEGIN {sqlite_rollup_upserts('NEW', '')} END""",
+        f"""CREATE TRIGGER transactions_balances_update AFTER UPDATE ON transactions
+            BEGIN {sqlite_rollup_upserts('OLD', '-')} {sqlite_rollup_upserts('NEW', '')} END""",
+        f"""CREATE TRIGGER transactions_balances_delete AFTER DELETE ON transactions
+            BEGIN {sqlite_rollup_upserts('OLD', '-')} END""",
+        """INSERT INTO customer_months (customer_id, month, received, given, pending, transaction_count)
+           SELECT customer_id, strftime('%Y-%m-01', date_time),
+                  SUM(CASE WHEN type = 'Received' THEN total_amount ELSE 0 END),
+                  SUM(CASE WHEN type = 'Given' THEN total_amount ELSE 0 END),
+                  SUM(amount_left), COUNT(*)
+           FROM transactions GROUP BY customer_id, strftime('%Y-%m-01', date_time)""",
+    ]),
+]
+
+INSERT_TRANSACTIONS = "INSERT INTO transactions (customer_id, date_time, type, total_amount, amount_received, amount_left, note)"
+
+POSTGRES_TABLES = [
+    """CREATE TABLE IF NOT EXISTS users (
+           id SERIAL PRIMARY KEY,
+           name TEXT NOT NULL,
+           email TEXT UNIQUE NOT NULL,
+           password TEXT NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS customers (
+           id SERIAL PRIMARY KEY,
+           user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+           name TEXT NOT NULL
+       )""",
+    """CREATE TABLE IF NOT EXISTS transactions (
+           id SERIAL PRIMARY KEY,
+           customer_id INTEGER NOT NULL REFERENCES customers(id) ON DELETE CASCADE,
+           date_time TIMESTAMP NOT NULL,
+           type TEXT NOT NULL CHECK (type IN ('Received', 'Given')),
+           total_amount NUMERIC DEFAULT 0,
+           amount_received NUMERIC DEFAULT 0,
+           amount_left NUMERIC DEFAULT 0,
+           note TEXT
+       )""",
+]
+
+
+def run_migrations(c, migrations, held=()):
+    # Returns the first held migration that is still pending, or None once everything has been applied.
+    c.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                 version INTEGER PRIMARY KEY,
+                 applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                 )''')
+    c.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+    current = c.fetchone()['version']
+    for version, statements in migrations:
+        if version <= current:
+            continue
+        if version in held:
+            return version
+        for statement in statements:
+            c.execute(statement)
+        c.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+
+
+class Backend:
+    name = None
+    migrations = []
+    schema_present_query = None
+    # What a LIMIT parameter has to be for "no limit".
+    unlimited = None
+    archives = False
+
+    def __init__(self, settings):
+        self.settings = settings
+
+    def schema_version(self, c):
+        c.execute(self.schema_present_query)
+        if not c.fetchone()['present']:
+            return 0
+        c.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+        return c.fetchone()['version']
+
+    def latest_version(self):
+        return self.migrations[-1][0]
+
+    def router(self):
+        return None
+
+    def change_listener(self, on_change, on_resync):
+        return None
+
+    def ensure_partitions(self, connect, dates):
+        pass
+
+    def archived_files(self, c, start=None, end=None):
+        return []
+
+    def copy_csv(self, c, out, conditions, params):
+        # Returns False where the caller has to write the rows itself.
+        return False
+
+
+class PostgresBackend(Backend):
+    name = 'postgres'
+    migrations = MIGRATIONS
+    schema_present_query = "SELECT to_regclass('schema_migrations') IS NOT NULL AS present"
+    archives = True
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self._partition_months = set()
+
+    def pool(self):
+        return db.get_pool(self.settings, cursor_factory=tracing.TracingCursor)
+
+    def router(self):
+        return routing.get_router(self.settings, cursor_factory=tracing.TracingCursor)
+
+    def change_listener(self, on_change, on_resync):
+        return changes.get_listener(db.primary_connect(self.settings), on_change, on_resync, self.settings)
+
+    def migrate(self, c, maintenance=False):
+        c.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))")
+        for statement in POSTGRES_TABLES:
+            c.execute(statement)
+        # On an empty ledger there is nothing to copy, so a fresh install needs no maintenance step.
+        c.execute("SELECT EXISTS (SELECT 1 FROM transactions) AS present")
+        held = MAINTENANCE_MIGRATIONS if c.fetchone()['present'] and not maintenance else ()
+        return run_migrations(c, self.migrations, held)
+
+    def ensure_partitions(self, connect, dates):
+        # Past months are always checked: the archive job may have dropped their partition from another process.
+        current = queries.month_start(queries.get_local_time())
+        missing = sorted(month for month in {queries.month_start(value) for value in dates}
+                         if month < current or month not in self._partition_months)
+        if not missing:
+            return
+        with connect() as conn:
+            c = conn.cursor()
+            c.execute("SELECT ensure_transaction_partitions(%s::date[])", ([month.date() for month in missing],))
+            conn.commit()
+        self._partition_months.update(month for month in missing if month >= current)
+
+    def like(self, column):
+        return f"{column} ILIKE %s"
+
+    def month_label(self, column):
+        return f"to_char({column}, 'YYYY-MM')"
+
+    def stream_cursor(self, conn, name, itersize):
+        # A named cursor keeps the result on the server and fetches it itersize rows at a time.
+        c = conn.cursor(name=name)
+        c.itersize = itersize
+        return c
+
+    def insert_rows(self, c, rows):
+        execute_values(c, f"{INSERT_TRANSACTIONS} VALUES %s", rows, page_size=1000)
+
+    def archived_files(self, c, start=None, end=None):
+        conditions, params = queries.archive_filter(start, end)
+        c.execute(f"SELECT path FROM transaction_archive WHERE {' AND '.join(conditions)} ORDER BY month DESC, path", params)
+        return [row['path'] for row in c.fetchall()]
+
+    def customer_search_query(self, user_id, term, limit):
+        matches_query, params = queries.customer_matches_query(self, user_id, term, limit)
+        query = f"""(SELECT COALESCE(json_agg(json_build_array(id, name) ORDER BY prefix DESC, name, id), '[]'::json)
+                     FROM ({matches_query}) matches)"""
+        return query, params
+
+    def search_customers(self, c, user_id, term, limit):
+        matches_query, matches_params = self.customer_search_query(user_id, term, limit)
+        c.execute(f"""SELECT {matches_query} AS matches,
+                             (SELECT COUNT(*) FROM customers WHERE user_id = %s) AS total""",
+                  (*matches_params, user_id))
+        row = c.fetchone()
+        return [(m[0], m[1]) for m in row['matches']], row['total']
+
+    def load_customer_page(self, c, user_id, customer_id, start_date, end_date, after, limit, today, search, customer_limit):
+        # Everything the page shows comes back from one statement, so a remote server costs a single round trip.
+        matches_query, matches_params = self.customer_search_query(user_id, search, customer_limit)
+        conditions, params = queries.transaction_filter(customer_id, start_date, end_date)
+        page_conditions, page_params = queries.after_filter(conditions, params, after)
+        summary_columns = ", ".join(f"{expression}::text" for expression in queries.SUMMARY_EXPRESSIONS)
+        archive_conditions, archive_params = queries.archive_filter(*queries.filter_bounds(start_date, end_date))
+        c.execute(f"""SELECT
+                          {matches_query} AS customers,
+                          (SELECT COUNT(*) FROM customers WHERE user_id = %s) AS customer_total,
+                          (SELECT name FROM customers WHERE id = %s AND user_id = %s) AS customer_name,
+                          (SELECT COALESCE(json_agg(json_build_array(id, date_time, type, total_amount::text,
+                                                                     amount_received::text, amount_left::text, note)
+                                                    ORDER BY date_time DESC, id DESC), '[]'::json)
+                           FROM (SELECT id, date_time, type, total_amount, amount_received, amount_left, note
+                                 FROM transactions WHERE {' AND '.join(page_conditions)}
+                                 ORDER BY date_time DESC, id DESC LIMIT %s) page) AS page,
+                          (SELECT json_build_array({summary_columns}, COUNT(*))
+                           FROM transactions WHERE {' AND '.join(conditions)}) AS summary,
+                          (SELECT COALESCE(json_agg(json_build_array(date_time, type, total_amount::text)
+                                                    ORDER BY date_time DESC), '[]'::json)
+                           FROM transactions WHERE customer_id = %s AND date_time >= %s AND date_time < %s) AS today,
+                          (SELECT COALESCE(json_agg(path ORDER BY month DESC, path), '[]'::json)
+                           FROM transaction_archive WHERE {' AND '.join(archive_conditions)}) AS archive,
+                          (SELECT COALESCE(json_agg(json_build_array({self.month_label('month')}, received::text,
+                                                                     given::text, pending::text, transaction_count)
+                                                    ORDER BY month), '[]'::json)
+                           FROM customer_months WHERE customer_id = %s AND transaction_count > 0) AS months""",
+                  (*matches_params, user_id, customer_id, user_id, *page_params, limit + 1, *params,
+                   customer_id, *queries.date_range_bounds(today, today), *archive_params, customer_id))
+        row = c.fetchone()
+        received, given, balance, outstanding, count = row['summary']
+        return queries.PageRows(
+            [(m[0], m[1]) for m in row['customers']], row['customer_total'], row['customer_name'],
+            [{'id': t[0], 'date_time': datetime.fromisoformat(t[1]), 'type': t[2], 'total_amount': queries.to_decimal(t[3]),
+              'amount_received': queries.to_decimal(t[4]), 'amount_left': queries.to_decimal(t[5]), 'note': t[6]}
+             for t in row['page']],
+            queries.Summary(Decimal(received), Decimal(given), Decimal(balance), Decimal(outstanding), count),
+            [(datetime.fromisoformat(t[0]), t[1], queries.to_decimal(t[2])) for t in row['today']],
+            [queries.MonthTotal(m[0], Decimal(m[1]), Decimal(m[2]), Decimal(m[3]), m[4]) for m in row['months']],
+            row['archive'])
+
+    def copy_csv(self, c, out, conditions, params):
+        query = c.mogrify(f"""SELECT id AS "ID", to_char(date_time, 'YYYY-MM-DD HH24:MI:SS') AS "Date & Time",
+                                     type AS "Type", total_amount AS "Total Amount",
+                                     amount_received AS "Amount Received", amount_left AS "Amount Left",
+                                     note AS "Note"
+                              FROM transactions WHERE {' AND '.join(conditions)}
+                              ORDER BY date_time DESC, id DESC""", params).decode()
+        c.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out, size=64 * 1024)
+        return True
+
+
+class SqliteBackend(Backend):
+    name = 'sqlite'
+    migrations = SQLITE_MIGRATIONS
+    schema_present_query = ("SELECT COUNT(*) AS present FROM sqlite_master "
+                            "WHERE type = 'table' AND name = 'schema_migrations'")
+    unlimited = -1
+
+    def pool(self):
+        return sqlite_db.get_pool(self.settings)
+
+    def migrate(self, c, maintenance=False):
+        # Take the write lock up front so concurrent processes migrate one at a time.
+        c.execute("BEGIN IMMEDIATE")
+        return run_migrations(c, self.migrations)
+
+    def like(self, column):
+        # SQLite's LIKE already ignores ASCII case but has no default escape character.
+        return f"{column} LIKE %s ESCAPE '\\'"
+
+    def month_label(self, column):
+        return f"strftime('%%Y-%%m', {column})"
+
+    def stream_cursor(self, conn, name, itersize):
+        # sqlite3 cursors already step through the result as it is fetched.
+        c = conn.cursor()
+        c.itersize = itersize
+        return c
+
+    def insert_rows(self, c, rows):
+        c.executemany(f"{INSERT_TRANSACTIONS} VALUES (%s, %s, %s, %s, %s, %s, %s)", rows)
+
+    def search_customers(self, c, user_id, term, limit):
+        matches_query, matches_params = queries.customer_matches_query(self, user_id, term, limit)
+        c.execute(matches_query, matches_params)
+        matches = [(m['id'], m['name']) for m in c.fetchall()]
+        c.execute("SELECT COUNT(*) AS total FROM customers WHERE user_id = %s", (user_id,))
+        return matches, c.fetchone()['total']
+
+    def load_customer_page(self, c, user_id, customer_id, start_date, end_date, after, limit, today, search, customer_limit):
+        # There is no round trip to save on a local file, so the page's queries run one by one.
+        matches_query, matches_params = queries.customer_matches_query(self, user_id, search, customer_limit)
+        conditions, params = queries.transaction_filter(customer_id, start_date, end_date)
+        page_conditions, page_params = queries.after_filter(conditions, params, after)
+        summary_columns = ", ".join(f"{expression} AS {name}"
+                                    for expression, name in zip(queries.SUMMARY_EXPRESSIONS, queries.Summary._fields))
+        c.execute(matches_query, matches_params)
+        customers = [(m['id'], m['name']) for m in c.fetchall()]
+        c.execute("""SELECT (SELECT COUNT(*) FROM customers WHERE user_id = %s) AS customer_total,
+                            (SELECT name FROM customers WHERE id = %s AND user_id = %s) AS customer_name""",
+                  (user_id, customer_id, user_id))
+        names = c.fetchone()
+        c.execute(f"""SELECT id, date_time, type, total_amount, amount_received, amount_left, note
+                      FROM transactions WHERE {' AND '.join(page_conditions)}
+                      ORDER BY date_time DESC, id DESC LIMIT %s""", (*page_params, limit + 1))
+        rows = c.fetchall()
+        c.execute(f"""SELECT {summary_columns}, COUNT(*) AS count
+                      FROM transactions WHERE {' AND '.join(conditions)}""", params)
+        row = c.fetchone()
+        summary = queries.Summary(queries.to_decimal(row['received']), queries.to_decimal(row['given']),
+                                  queries.to_decimal(row['balance']), queries.to_decimal(row['outstanding']), row['count'])
+        c.execute("""SELECT date_time, type, total_amount FROM transactions
+                     WHERE customer_id = %s AND date_time >= %s AND date_time < %s ORDER BY date_time DESC""",
+                  (customer_id, *queries.date_range_bounds(today, today)))
+        today_trans = [(t['date_time'], t['type'], queries.to_decimal(t['total_amount'])) for t in c.fetchall()]
+        c.execute(queries.month_totals_query(self), (customer_id,))
+        months = [queries.month_total(m) for m in c.fetchall()]
+        return queries.PageRows(customers, names['customer_total'], names['customer_name'], rows, summary, today_trans,
+                                months, [])
+
+
+BACKENDS = {
+    'postgres': PostgresBackend,
+    'sqlite': SqliteBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend(settings):
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = settings.get("DB_BACKEND", "postgres")
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown DB_BACKEND {name!r}; expected one of {', '.join(BACKENDS)}")
+                _backend = BACKENDS[name](settings)
+    return _backend
@@ -0,0 +1,91 @@
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from login_throughput import percentile
+
+
+class Client:
+    def __init__(self, url, token=None):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.token = token
+
+    def request(self, method, path, payload=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        self.conn.request(method, path, body=None if payload is None else json.dumps(payload), headers=headers)
+        response = self.conn.getresponse()
+        body = json.loads(response.read())
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status}: {body}")
+        return body
+
+
+def run(url, token, customer_id, terminals, batch, duration):
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    entries = [{'customer_id': customer_id, 'type': 'Given', 'total_amount': '12.50', 'amount_received': '2.50',
+                'note': 'api benchmark'}] * batch
+
+    def terminal():
+        client = Client(url, token)
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            client.request('POST', '/api/transactions', {'transactions': entries})
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=terminal) for _ in range(terminals)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'writes_per_sec': len(latencies) * batch / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': (statistics.fmean(latencies) * 1000) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure transaction write throughput through the JSON API.")
+    parser.add_argument('--url', default='http://127.0.0.1:8502')
+    parser.add_argument('--email', default='admin@example.com')
+    parser.add_argument('--password', default='admin123')
+    parser.add_argument('--customer-id', type=int, required=True, help="a customer owned by this user; rows are added to it")
+    parser.add_argument('--terminals', type=int, default=8, help="concurrent simulated terminals")
+    parser.add_argument('--batches', type=int, nargs='+', default=[1, 10, 100], help="transactions per request")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    token = Client(args.url).request('POST', '/api/login', {'email': args.email, 'password': args.password})['token']
+    results = {'terminals': args.terminals, 'scenarios': {}}
+    for batch in args.batches:
+        results['scenarios'][f'batch_{batch}'] = run(args.url, token, args.customer_id, args.terminals, batch, args.duration)
+
+    print(f"{'scenario':<12}{'writes/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<12}{result['writes_per_sec']:>12.1f}{result['p50_ms']:>10.1f}"
+              f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
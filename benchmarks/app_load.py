@@ -0,0 +1,373 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import records
+import tracing
+from data_layer import git_commit, load_dataset, percentile
+
+APP = os.path.join(ROOT, 'app.py')
+PASSWORD = 'bench-password'
+# share_runtime() patches Streamlit internals, so the benchmark only runs on the version pinned in
+# benchmarks/requirements.txt.
+STREAMLIT_VERSION = '1.66.0'
+STEPS = ['open', 'login', 'select_customer', 'switch_filter', 'open_add_form', 'add', 'select_row', 'open_edit', 'save_edit',
+         'delete', 'confirm_delete', 'export']
+
+
+class RerunLog(logging.Handler):
+    # The query tracer logs one summary per rerun; queries per interaction are read back from here by rerun id.
+    def __init__(self):
+        super().__init__()
+        self.reruns = {}
+        self._reruns_lock = threading.Lock()
+
+    def emit(self, record):
+        message = record.getMessage()
+        if not message.startswith('{"event": "rerun"'):
+            return
+        event = json.loads(message)
+        with self._reruns_lock:
+            self.reruns[event['rerun_id']] = event
+
+    def queries(self, trace_session, first, last):
+        with self._reruns_lock:
+            found = [self.reruns.get(f"{trace_session}-{n}") for n in range(first, last + 1)]
+        return sum(event['queries'] for event in found if event)
+
+
+class FlowError(Exception):
+    pass
+
+
+def check_streamlit():
+    # Fail before any data is loaded rather than part-way through a run on a Streamlit that share_runtime() doesn't fit.
+    import streamlit
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    if streamlit.__version__ != STREAMLIT_VERSION:
+        raise SystemExit(f"app_load.py patches Streamlit internals and is pinned to streamlit=={STREAMLIT_VERSION}, "
+                         f"found {streamlit.__version__}; pip install -r benchmarks/requirements.txt")
+    missing = [name for owner, name in ((Runtime, '_instance'), (Runtime, 'instance'), (Runtime, 'exists'),
+                                        (ScriptCache, 'get_bytecode')) if not hasattr(owner, name)]
+    if missing:
+        raise SystemExit(f"Streamlit no longer has {', '.join(missing)}; share_runtime() needs updating")
+
+
+def share_runtime(secrets):
+    # AppTest swaps in st.secrets, a mock runtime and the appTest config flag for each run and takes them away when it
+    # ends, which breaks any run still going on another thread. Keep all three in place for the whole process instead,
+    # the way a real server process has one runtime and one secrets file for every session. The server also compiles
+    # the script once for all sessions, where AppTest recompiles it on every run.
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    path = os.path.join(tempfile.mkdtemp(prefix='app_load_'), 'secrets.toml')
+    with open(path, 'w') as f:
+        for key, value in secrets.items():
+            f.write(f"{key} = {json.dumps(value)}\n")
+    config.set_option('secrets.files', [path])
+    config.set_option('global.appTest', True)
+    installed = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            installed['runtime'] = cls._instance
+        return installed['runtime']
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or 'runtime' in installed)
+
+    compile_script = ScriptCache.get_bytecode
+    compiled = {}
+    compile_lock = threading.Lock()
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in compiled:
+                compiled[script_path] = compile_script(self, script_path)
+            return compiled[script_path]
+
+    ScriptCache.get_bytecode = get_bytecode
+
+
+class Session:
+    def __init__(self, log, email, customer_id, think):
+        from streamlit.testing.v1 import AppTest
+        self.at = AppTest.from_file(APP, default_timeout=300)
+        self.log = log
+        self.email = email
+        self.customer_id = customer_id
+        self.think = think
+        self.samples = []
+
+    def reruns(self):
+        return self.at.session_state['trace_reruns'] if 'trace_reruns' in self.at.session_state else 0
+
+    def button(self, label):
+        for button in self.at.button:
+            if button.label == label:
+                return button
+        raise FlowError(f"no {label!r} button")
+
+    def step(self, name, action):
+        before = self.reruns()
+        started = time.perf_counter()
+        action()
+        elapsed = time.perf_counter() - started
+        if self.at.exception:
+            raise FlowError(f"{name}: {self.at.exception[0].message}")
+        after = self.reruns()
+        queries = self.log.queries(self.at.session_state['trace_session'], before + 1, after)
+        self.samples.append((name, elapsed, after - before, queries))
+        if self.think:
+            time.sleep(self.think)
+
+    def select_row(self, index=0):
+        grid = self.at.dataframe[0]
+        self.at.session_state[grid.key] = {'selection': {'rows': [index], 'columns': [], 'cells': []}}
+        self.at.run()
+
+    def login(self):
+        self.at.text_input[0].input(self.email)
+        self.at.text_input[1].input(PASSWORD)
+        self.button("🚀 Login").click().run()
+
+    def add(self):
+        self.at.number_input[0].set_value(125.0)
+        self.at.number_input[1].set_value(25.0)
+        self.at.text_area[0].input("load test")
+        self.button("💾 Save Transaction").click().run()
+
+    def save_edit(self):
+        self.at.number_input[0].set_value(150.0)
+        self.button("💾 Save Transaction").click().run()
+
+    def export(self):
+        [box for box in self.at.selectbox if box.label == "Export Format"][0].select("CSV")
+        self.button("📥 Prepare Records (CSV)").click().run()
+
+    def flow(self):
+        at = self.at
+        self.step('open', at.run)
+        self.step('login', self.login)
+        self.step('select_customer', lambda: at.selectbox(key='customer_select').select(self.customer_id).run())
+        self.step('switch_filter', lambda: at.radio(key='filter_type').set_value("All Transactions").run())
+        self.step('open_add_form', lambda: self.button("➕ Add Transaction").click().run())
+        self.step('add', self.add)
+        self.step('select_row', self.select_row)
+        self.step('open_edit', lambda: self.button("✏️ Edit Selected").click().run())
+        self.step('save_edit', self.save_edit)
+        self.select_row()
+        self.step('delete', lambda: self.button("🗑️ Delete Selected").click().run())
+        self.step('confirm_delete', lambda: self.button("✅ Yes, Delete").click().run())
+        self.step('export', self.export)
+
+
+def summarize(samples, errors, elapsed):
+    by_step = defaultdict(list)
+    for name, seconds, reruns, queries in samples:
+        by_step[name].append((seconds, reruns, queries))
+    steps = {}
+    for name in STEPS:
+        rows = by_step.get(name)
+        if not rows:
+            continue
+        timings = [row[0] for row in rows]
+        reruns = sum(row[1] for row in rows)
+        queries = sum(row[2] for row in rows)
+        steps[name] = {
+            'runs': len(rows),
+            'p50_ms': percentile(timings, 50) * 1000,
+            'p90_ms': percentile(timings, 90) * 1000,
+            'p99_ms': percentile(timings, 99) * 1000,
+            'mean_ms': statistics.fmean(timings) * 1000,
+            'reruns_per_interaction': reruns / len(rows),
+            'queries_per_interaction': queries / len(rows),
+            'queries_per_rerun': queries / reruns if reruns else 0.0,
+        }
+    timings = [sample[1] for sample in samples]
+    return {
+        'interactions': len(samples),
+        'interactions_per_sec': len(samples) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p90_ms': percentile(timings, 90) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'queries_per_rerun': sum(s[3] for s in samples) / max(1, sum(s[2] for s in samples)),
+        'errors': errors,
+        'steps': steps,
+    }
+
+
+def run(log, targets, sessions, flows, think):
+    samples, errors = [], []
+    lock = threading.Lock()
+
+    def simulate(index):
+        email, customer_id = targets[index % len(targets)]
+        for _ in range(flows):
+            # Each flow is a fresh browser session, so the login and first render are paid every time.
+            session = Session(log, email, customer_id, think)
+            try:
+                session.flow()
+            except (FlowError, IndexError, KeyError) as e:
+                with lock:
+                    errors.append(str(e))
+            with lock:
+                samples.extend(session.samples)
+
+    threads = [threading.Thread(target=simulate, args=(i,)) for i in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(samples, errors, time.perf_counter() - started)
+
+
+def session_memory(log, targets, count):
+    # Retained Python heap per live session after a full flow, with every session kept open like a browser tab.
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    sessions = []
+    for i in range(count):
+        email, customer_id = targets[i % len(targets)]
+        sessions.append(Session(log, email, customer_id, 0))
+        sessions[-1].flow()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'sessions': count, 'retained_kb_per_session': (retained - base) / count / 1024, 'peak_kb': (peak - base) / 1024}
+
+
+def pick_targets(per_user):
+    # Customers from the default selectbox list (the first page by name), one per simulated session where possible.
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, email FROM users WHERE email LIKE %s ORDER BY id", ('bench-%@example.com',))
+        users = c.fetchall()
+    if not users:
+        raise SystemExit("no benchmark data found; run without --keep first")
+    targets = []
+    for user in users:
+        customers, _ = records.search_customers(user['id'])
+        targets.append([(user['email'], customer_id) for customer_id, _ in customers[:per_user]])
+    # Interleave users so concurrent sessions spread across them.
+    return [target for group in zip(*targets) for target in group]
+
+
+def set_passwords():
+    hashed = records.get_hasher().hash(PASSWORD)
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("""UPDATE users SET password = %s, password_algorithm = %s, password_iterations = %s, password_salt = %s
+                     WHERE email LIKE %s""",
+                  (hashed.hash, hashed.algorithm, hashed.iterations, hashed.salt, 'bench-%@example.com'))
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py reruns with concurrent scripted AppTest sessions.")
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'], default='postgres')
+    parser.add_argument('--sqlite-path', default='balance_bench.db')
+    parser.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    parser.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'balance_bench'))
+    parser.add_argument('--user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('--sslmode', default=os.environ.get('PGSSLMODE', 'prefer'))
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--customers', type=int, default=100, help="customers per user")
+    parser.add_argument('--transactions', type=int, default=200000, help="total transactions across all customers")
+    parser.add_argument('--skew', type=float, default=1.1, help="zipf exponent for history length per customer")
+    parser.add_argument('--days', type=int, default=730, help="days of history to spread transactions over")
+    parser.add_argument('--chunk', type=int, default=50000, help="rows per COPY batch")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help="reuse the data loaded by a previous run")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 4, 16], help="concurrent sessions per scenario")
+    parser.add_argument('--flows', type=int, default=2, help="flows each simulated session runs")
+    parser.add_argument('--think', type=float, default=0.0, help="seconds a user pauses between interactions")
+    parser.add_argument('--pool-max', type=int, default=10)
+    parser.add_argument('--memory-sessions', type=int, default=5, help="live sessions to average memory over (0 to skip)")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+    check_streamlit()
+
+    settings = {
+        'DB_BACKEND': args.backend,
+        'SQLITE_PATH': os.path.abspath(args.sqlite_path),
+        'DB_HOST': args.host,
+        'DB_PORT': args.port,
+        'DB_NAME': args.dbname,
+        'DB_USER': args.user,
+        'DB_PASSWORD': args.password,
+        'DB_SSLMODE': args.sslmode,
+        'DB_POOL_MAX': args.pool_max,
+    }
+    records.configure(settings)
+    records.ensure_schema()
+    if not args.keep:
+        started = time.perf_counter()
+        load_dataset(args)
+        print(f"loaded {args.transactions} transactions in {time.perf_counter() - started:.1f}s")
+    set_passwords()
+    targets = pick_targets(max(args.sessions))
+
+    # Tracing is how queries per rerun are counted; EXPLAIN stays off so it doesn't add its own queries.
+    log = RerunLog()
+    tracing.logger.addHandler(log)
+    tracing.logger.setLevel(logging.INFO)
+    tracing.logger.propagate = False
+    share_runtime({**settings, 'QUERY_TRACE': True, 'QUERY_EXPLAIN_SLOW': False})
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('password', 'json')},
+        'scenarios': {},
+    }
+    # One untimed flow so imports and the first script compile don't land in the first scenario.
+    Session(log, *targets[0], 0).flow()
+    for sessions in args.sessions:
+        # Every scenario starts from a cold read cache, so results don't depend on the scenarios before it.
+        records.get_cache().clear()
+        results['scenarios'][f'sessions_{sessions}'] = run(log, targets, sessions, args.flows, args.think)
+    if args.memory_sessions:
+        results['memory'] = session_memory(log, targets, args.memory_sessions)
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['pool'] = records.get_pool().stats()
+
+    for name, scenario in results['scenarios'].items():
+        print(f"{name}: {scenario['interactions_per_sec']:.1f} interactions/s, {scenario['queries_per_rerun']:.1f} queries/rerun, "
+              f"{len(scenario['errors'])} errors")
+        print(f"  {'interaction':<18}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'reruns':>9}{'queries':>9}")
+        for step, result in scenario['steps'].items():
+            print(f"  {step:<18}{result['p50_ms']:>10.1f}{result['p90_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+                  f"{result['reruns_per_interaction']:>9.1f}{result['queries_per_interaction']:>9.1f}")
+    if 'memory' in results:
+        print(f"memory: {results['memory']['retained_kb_per_session']:.0f} KiB retained per live session "
+              f"({results['memory']['sessions']} sessions)")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
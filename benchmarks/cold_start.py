@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so every sample pays the full import and first-session cost.
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, {repo!r})
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+
+def session():
+    at = AppTest.from_file({app!r}, default_timeout=120)
+    for key, value in {secrets!r}.items():
+        at.secrets[key] = value
+    began = time.perf_counter()
+    at.run()
+    if at.exception:
+        raise SystemExit(at.exception[0].message)
+    return time.perf_counter() - began
+
+first = session()
+second = session()
+print(json.dumps({{
+    'streamlit_import_s': imported - started,
+    'first_session_s': first,
+    'second_session_s': second,
+    'heavy_modules': sorted(m for m in ('numpy', 'pandas', 'pyarrow', 'psycopg2') if m in sys.modules),
+}}))
+"""
+
+
+def sample(repo, secrets):
+    code = CHILD.format(repo=repo, app=os.path.join(repo, 'app.py'), secrets=secrets)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=repo)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise SystemExit(result.stderr.strip().splitlines()[-1])
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    measured['process_s'] = elapsed
+    return measured
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure process cold start and first-session render time.")
+    parser.add_argument('--repo', default=ROOT, help="checkout to measure, e.g. a git worktree of an older commit")
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'], default='postgres')
+    parser.add_argument('--sqlite-path', default='balance_bench.db')
+    parser.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    parser.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'balance_bench'))
+    parser.add_argument('--user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('--sslmode', default=os.environ.get('PGSSLMODE', 'prefer'))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    secrets = {
+        'DB_BACKEND': args.backend,
+        'SQLITE_PATH': os.path.abspath(args.sqlite_path),
+        'DB_HOST': args.host,
+        'DB_PORT': args.port,
+        'DB_NAME': args.dbname,
+        'DB_USER': args.user,
+        'DB_PASSWORD': args.password,
+        'DB_SSLMODE': args.sslmode,
+    }
+    repo = os.path.abspath(args.repo)
+    samples = [sample(repo, secrets) for _ in range(args.repeat)]
+    results = {
+        'repo': repo,
+        'commit': subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, capture_output=True, text=True).stdout.strip(),
+        'backend': args.backend,
+        'samples': samples,
+        'heavy_modules': samples[-1]['heavy_modules'],
+    }
+    for key in ('process_s', 'streamlit_import_s', 'first_session_s', 'second_session_s'):
+        results[key] = statistics.median(s[key] for s in samples)
+
+    print(f"commit {results['commit'][:10]} ({args.backend}, median of {args.repeat})")
+    print(f"  process cold start to first render: {results['process_s'] * 1000:8.1f} ms")
+    print(f"  first session render:               {results['first_session_s'] * 1000:8.1f} ms")
+    print(f"  second session render:              {results['second_session_s'] * 1000:8.1f} ms")
+    print(f"  heavy modules loaded: {', '.join(results['heavy_modules']) or 'none'}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
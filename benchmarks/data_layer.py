@@ -0,0 +1,264 @@
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import records
+
+COPY_TRANSACTIONS = """COPY transactions (customer_id, date_time, type, total_amount, amount_received, amount_left, note)
+                       FROM STDIN WITH (FORMAT csv)"""
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def uncached(func):
+    return getattr(func, '__wrapped__', func)
+
+
+def transaction_counts(rng, customers, transactions, skew):
+    # Zipf-like weights so a handful of customers carry most of the history.
+    weights = 1.0 / np.arange(1, customers + 1) ** skew
+    counts = rng.multinomial(transactions, weights / weights.sum())
+    rng.shuffle(counts)
+    return counts
+
+
+def write_chunk(c, rng, customer_id, count, start, span):
+    offsets = np.sort(rng.integers(0, span, size=count))
+    received = rng.random(count) < 0.5
+    totals = np.round(rng.gamma(2.0, 2500.0, size=count), 2)
+    paid = np.where(received, totals, np.round(totals * rng.random(count), 2))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for offset, is_received, total, amount_paid in zip(offsets.tolist(), received.tolist(), totals.tolist(), paid.tolist()):
+        writer.writerow([customer_id, (start + timedelta(seconds=offset)).strftime('%Y-%m-%d %H:%M:%S'),
+                         'Received' if is_received else 'Given', f"{total:.2f}", f"{amount_paid:.2f}",
+                         f"{total - amount_paid:.2f}", "synthetic"])
+    buffer.seek(0)
+    if records.get_backend().name == 'sqlite':
+        c.executemany("""INSERT INTO transactions (customer_id, date_time, type, total_amount, amount_received, amount_left, note)
+                         VALUES (%s, %s, %s, %s, %s, %s, %s)""", csv.reader(buffer))
+    else:
+        c.copy_expert(COPY_TRANSACTIONS, buffer)
+
+
+def load_dataset(args):
+    rng = np.random.default_rng(args.seed)
+    end = datetime.now().replace(microsecond=0)
+    start = end - timedelta(days=args.days)
+    span = int((end - start).total_seconds())
+    months = [records.month_start(start)]
+    while months[-1] < records.month_start(end):
+        months.append(records.add_months(months[-1], 1))
+    records.ensure_partitions(months)
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM users WHERE email LIKE %s", ('bench-%@example.com',))
+        users = []
+        for u in range(args.users):
+            c.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s) RETURNING id",
+                      (f'Bench User {u}', f'bench-{u}@example.com', 'x'))
+            users.append(c.fetchone()['id'])
+        customers = []
+        for user_id in users:
+            for i in range(args.customers):
+                c.execute("INSERT INTO customers (user_id, name) VALUES (%s, %s) RETURNING id",
+                          (user_id, f'Customer {user_id}-{i:05d}'))
+                customers.append((user_id, c.fetchone()['id']))
+        counts = transaction_counts(rng, len(customers), args.transactions, args.skew)
+        for (_, customer_id), count in zip(customers, counts.tolist()):
+            for offset in range(0, count, args.chunk):
+                write_chunk(c, rng, customer_id, min(args.chunk, count - offset), start, span)
+        c.execute("ANALYZE transactions")
+        c.execute("ANALYZE customers")
+        conn.commit()
+
+
+def pick_targets():
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT c.user_id, c.id, COUNT(t.id) AS n
+                     FROM customers c JOIN users u ON u.id = c.user_id
+                     LEFT JOIN transactions t ON t.customer_id = c.id
+                     WHERE u.email LIKE %s
+                     GROUP BY c.user_id, c.id ORDER BY n DESC, c.id""", ('bench-%@example.com',))
+        rows = c.fetchall()
+        if not rows:
+            raise SystemExit("no benchmark data found; run without --keep first")
+        c.execute("SELECT MAX(id) AS id FROM transactions WHERE customer_id = %s", (rows[0]['id'],))
+        trans_id = c.fetchone()['id']
+    return {
+        'heavy': rows[0],
+        'median': rows[len(rows) // 2],
+        'customers': len(rows),
+        'transactions': sum(row['n'] for row in rows),
+        'trans_id': trans_id,
+    }
+
+
+def measure(func, repeat, warmup):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'runs': repeat,
+        'p50_ms': percentile(timings, 50) * 1000,
+        'p90_ms': percentile(timings, 90) * 1000,
+        'p99_ms': percentile(timings, 99) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'min_ms': min(timings) * 1000,
+        'max_ms': max(timings) * 1000,
+        'peak_kb': peak / 1024,
+    }
+
+
+def scenarios(targets):
+    get_customers = uncached(records.get_customers)
+    get_transactions = records.get_transactions
+    get_available_months = uncached(records.get_available_months)
+    load_customer_page = uncached(records.load_customer_page)
+    trans_id = targets['trans_id']
+    update_types = iter(['Received', 'Given'] * 1000000)
+
+    cases = {}
+    for label in ('heavy', 'median'):
+        user_id, customer_id = targets[label]['user_id'], targets[label]['id']
+        months = get_available_months(customer_id)
+        month = months[0] if months else None
+        today = records.get_local_time().date()
+        cases.update({
+            f'get_customers[{label}]': lambda u=user_id: get_customers(u),
+            f'get_transactions.all[{label}]': lambda c=customer_id: get_transactions(c),
+            f'get_transactions.month[{label}]': lambda c=customer_id, m=month: get_transactions(c, month_filter=m),
+            f'get_transactions.range[{label}]': lambda c=customer_id, d=today: get_transactions(
+                c, start_date=d - timedelta(days=30), end_date=d),
+            f'get_available_months[{label}]': lambda c=customer_id: get_available_months(c),
+            f'load_customer_page[{label}]': lambda u=user_id, c=customer_id: load_customer_page(u, c),
+            f'export_csv[{label}]': lambda c=customer_id: records.build_export('CSV', c),
+        })
+    heavy = targets['heavy']['id']
+    cases['add_transaction'] = lambda: records.add_transaction(heavy, 'Given', 100, 40, 60, 'benchmark')
+    cases['update_transaction'] = lambda: records.update_transaction(trans_id, next(update_types), 100, 40, 60, 'benchmark')
+    return cases
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the data-layer functions against synthetic ledgers.")
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'], default='postgres')
+    parser.add_argument('--sqlite-path', default='balance_bench.db')
+    parser.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    parser.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'balance_bench'))
+    parser.add_argument('--user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('--sslmode', default=os.environ.get('PGSSLMODE', 'prefer'))
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--customers', type=int, default=100, help="customers per user")
+    parser.add_argument('--transactions', type=int, default=200000, help="total transactions across all customers")
+    parser.add_argument('--skew', type=float, default=1.1, help="zipf exponent for history length per customer")
+    parser.add_argument('--days', type=int, default=730, help="days of history to spread transactions over")
+    parser.add_argument('--chunk', type=int, default=50000, help="rows per COPY batch")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=30, help="timed runs per scenario")
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--keep', action='store_true', help="reuse the data loaded by a previous run")
+    parser.add_argument('--only', nargs='+', help="run scenarios whose name starts with any of these")
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    records.configure({
+        'DB_BACKEND': args.backend,
+        'SQLITE_PATH': args.sqlite_path,
+        'DB_HOST': args.host,
+        'DB_PORT': args.port,
+        'DB_NAME': args.dbname,
+        'DB_USER': args.user,
+        'DB_PASSWORD': args.password,
+        'DB_SSLMODE': args.sslmode,
+        'DB_POOL_MIN': 1,
+        'DB_POOL_MAX': 2,
+    })
+    records.init_db()
+
+    if not args.keep:
+        started = time.perf_counter()
+        load_dataset(args)
+        print(f"loaded {args.transactions} transactions in {time.perf_counter() - started:.1f}s")
+    targets = pick_targets()
+
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        if records.get_backend().name == 'sqlite':
+            c.execute("SELECT sqlite_version() AS version")
+        else:
+            c.execute("SELECT current_setting('server_version') AS version")
+        server_version = c.fetchone()['version']
+
+    results = {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'server_version': server_version,
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('password', 'json')},
+        'dataset': {
+            'customers': targets['customers'],
+            'transactions': targets['transactions'],
+            'heavy_customer_transactions': targets['heavy']['n'],
+            'median_customer_transactions': targets['median']['n'],
+        },
+        'scenarios': {},
+    }
+    for name, func in scenarios(targets).items():
+        if args.only and not any(name.startswith(prefix) for prefix in args.only):
+            continue
+        results['scenarios'][name] = measure(func, args.repeat, args.warmup)
+    results['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['pool'] = records.get_pool().stats()
+
+    print(f"{'scenario':<36}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<36}{result['p50_ms']:>10.2f}{result['p90_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}{result['peak_kb']:>12.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
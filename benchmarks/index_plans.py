@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import re
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import records
+import tracing
+from data_layer import load_dataset, pick_targets, uncached
+
+INDEX = 'idx_transactions_customer_date_id'
+PG_INDEX_USE = re.compile(r'(?:Index (?:Only )?Scan(?: Backward)? using (\S+) on|Bitmap Index Scan on (\S+))')
+PG_SEQ_SCAN = re.compile(r'Seq Scan on (transactions\w*)')
+PG_SORT = re.compile(r'\bSort\s+\(')
+SQLITE_INDEX_USE = re.compile(r'(?:SEARCH|SCAN) transactions USING (?:COVERING )?INDEX (\S+)')
+
+
+def allowed_indexes():
+    # On Postgres each partition has its own copy of the index, attached to the parent one.
+    if records.get_backend().name == 'sqlite':
+        return {INDEX}
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("""WITH RECURSIVE children AS (
+                         SELECT %s::regclass AS oid
+                         UNION ALL
+                         SELECT i.inhrelid FROM pg_inherits i JOIN children ON i.inhparent = children.oid
+                     )
+                     SELECT oid::regclass::text AS name FROM children""", (INDEX,))
+        names = {row['name'] for row in c.fetchall()}
+        conn.rollback()
+    return names
+
+
+def traced_plans(func):
+    # slow_ms=0 makes the tracer EXPLAIN every query it sees, so the plans are those of the app's own SQL.
+    tracer = tracing.Tracer(enabled=True, slow_ms=0, explain=True)
+    trace = tracer.start('index_plans')
+    try:
+        func()
+    finally:
+        tracing._local.trace = None
+    return [entry for entry in trace.queries if re.search(r'\bFROM transactions\b', entry['sql'])]
+
+
+def problems(plan, indexes, limited):
+    # A sort only defeats the index where a LIMIT could have stopped the scan early; sorting a day's rows is fine.
+    if records.get_backend().name == 'sqlite':
+        used = set(SQLITE_INDEX_USE.findall(plan))
+        found = []
+        if 'SCAN transactions' in plan and not used:
+            found.append("full scan of transactions")
+        if limited and 'TEMP B-TREE' in plan:
+            found.append("sorts instead of reading in index order")
+    else:
+        used = {name for pair in PG_INDEX_USE.findall(plan) for name in pair if name}
+        found = [f"sequential scan of {name}" for name in sorted(set(PG_SEQ_SCAN.findall(plan)))]
+        if limited and PG_SORT.search(plan):
+            found.append("sorts instead of reading in index order")
+    if not used & indexes:
+        found.append(f"does not use {INDEX}")
+    found.extend(f"uses {name}" for name in sorted(used - indexes))
+    return found
+
+
+def cases(targets):
+    get_transactions = uncached(records.get_transactions)
+    get_today_transactions = uncached(records.get_today_transactions)
+    get_transactions_page = uncached(records.get_transactions_page)
+    today = records.get_local_time().date()
+    found = {}
+    for label in ('heavy', 'median'):
+        customer_id = targets[label]['id']
+        months = uncached(records.get_available_months)(customer_id)
+        found.update({
+            f'range[{label}]': lambda c=customer_id: get_transactions(c, start_date=today - timedelta(days=30), end_date=today),
+            f'month[{label}]': lambda c=customer_id, m=months[0] if months else None: get_transactions(c, month_filter=m),
+            f'today[{label}]': lambda c=customer_id: get_today_transactions(c, today),
+            f'page[{label}]': lambda c=customer_id: get_transactions_page(c, limit=50),
+        })
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the history queries are planned on the (customer_id, date_time DESC, id DESC) index.")
+    parser.add_argument('--backend', choices=['postgres', 'sqlite'], default='postgres')
+    parser.add_argument('--sqlite-path', default='balance_bench.db')
+    parser.add_argument('--host', default=os.environ.get('PGHOST', 'localhost'))
+    parser.add_argument('--port', default=os.environ.get('PGPORT', '5432'))
+    parser.add_argument('--dbname', default=os.environ.get('PGDATABASE', 'balance_bench'))
+    parser.add_argument('--user', default=os.environ.get('PGUSER', 'postgres'))
+    parser.add_argument('--password', default=os.environ.get('PGPASSWORD', ''))
+    parser.add_argument('--sslmode', default=os.environ.get('PGSSLMODE', 'prefer'))
+    parser.add_argument('--users', type=int, default=2)
+    parser.add_argument('--customers', type=int, default=100, help="customers per user")
+    parser.add_argument('--transactions', type=int, default=1000000, help="total transactions across all customers")
+    parser.add_argument('--min-rows', type=int, default=1000000, help="refuse to judge plans on a smaller table")
+    parser.add_argument('--skew', type=float, default=1.1, help="zipf exponent for history length per customer")
+    parser.add_argument('--days', type=int, default=730, help="days of history to spread transactions over")
+    parser.add_argument('--chunk', type=int, default=50000, help="rows per COPY batch")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep', action='store_true', help="reuse the data loaded by a previous run")
+    parser.add_argument('--verbose', action='store_true', help="print every plan")
+    parser.add_argument('--json', help="write plans and results to this file")
+    args = parser.parse_args()
+
+    records.configure({
+        'DB_BACKEND': args.backend,
+        'SQLITE_PATH': args.sqlite_path,
+        'DB_HOST': args.host,
+        'DB_PORT': args.port,
+        'DB_NAME': args.dbname,
+        'DB_USER': args.user,
+        'DB_PASSWORD': args.password,
+        'DB_SSLMODE': args.sslmode,
+        'DB_POOL_MIN': 1,
+        'DB_POOL_MAX': 2,
+    })
+    records.init_db()
+    if not args.keep:
+        load_dataset(args)
+    targets = pick_targets()
+    if targets['transactions'] < args.min_rows:
+        raise SystemExit(f"only {targets['transactions']} benchmark transactions loaded; need at least {args.min_rows}")
+
+    indexes = allowed_indexes()
+    results = {'transactions': targets['transactions'], 'cases': {}}
+    failed = False
+    print(f"{targets['transactions']} transactions; heavy customer has {targets['heavy']['n']}, "
+          f"median {targets['median']['n']}")
+    for name, func in cases(targets).items():
+        entries = traced_plans(func)
+        plans = [entry['explain'] or '' for entry in entries]
+        found = [problem for entry, plan in zip(entries, plans)
+                 for problem in problems(plan, indexes, re.search(r'\bLIMIT\b', entry['sql']) is not None)]
+        if not plans:
+            found.append("no query on transactions was traced")
+        failed = failed or bool(found)
+        results['cases'][name] = {'ok': not found, 'problems': found, 'plans': plans}
+        print(f"{name:<16}{'ok' if not found else 'FAIL: ' + '; '.join(found)}")
+        if args.verbose or found:
+            for plan in plans:
+                print("    " + plan.replace("\n", "\n    "))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
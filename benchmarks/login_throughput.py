@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def probe(deadline, latencies):
+    # Stands in for the other requests the server handles while logins are hashing.
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        sum(range(500000))
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+
+
+def run(verify, sessions, duration):
+    latencies = []
+    probes = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def session():
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if not verify():
+                raise RuntimeError("password did not verify")
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    threads.append(threading.Thread(target=probe, args=(deadline, probes)))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'logins': len(latencies),
+        'logins_per_sec': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': (statistics.fmean(latencies) * 1000) if latencies else 0.0,
+        'other_p50_ms': percentile(probes, 50) * 1000,
+        'other_p99_ms': percentile(probes, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure login password-verification throughput.")
+    parser.add_argument('--sessions', type=int, default=16, help="concurrent simulated logins")
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per scenario")
+    parser.add_argument('--iterations', type=int, default=passwords.LEGACY_ITERATIONS)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 4])
+    parser.add_argument('--json', help="write results to this file")
+    args = parser.parse_args()
+
+    password = 'correct horse battery staple'
+    results = {'sessions': args.sessions, 'iterations': args.iterations, 'scenarios': {}}
+
+    legacy = passwords.PasswordHash(None, None, None,
+                                    passwords.derive(password, passwords.LEGACY_SALT, passwords.LEGACY_ITERATIONS))
+    inline = lambda: passwords.derive(password, passwords.LEGACY_SALT, passwords.LEGACY_ITERATIONS) == legacy.hash
+    results['scenarios']['inline'] = run(inline, args.sessions, args.duration)
+
+    for workers in sorted(set(args.workers)):
+        hasher = passwords.PasswordHasher(iterations=args.iterations, workers=workers)
+        stored = hasher.hash(password)
+        results['scenarios'][f'pool_{workers}'] = run(lambda: hasher.verify(password, stored), args.sessions, args.duration)
+        hasher.shutdown()
+
+    print(f"{'scenario':<12}{'logins/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'other p50':>12}{'other p99':>12}")
+    for name, result in results['scenarios'].items():
+        print(f"{name:<12}{result['logins_per_sec']:>12.1f}{result['p50_ms']:>10.1f}"
+              f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}"
+              f"{result['other_p50_ms']:>12.1f}{result['other_p99_ms']:>12.1f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import records
+
+EMAIL = 'routing-check@example.com'
+SETUP = """two local instances:
+  initdb -D /tmp/primary -U postgres --auth=trust
+  echo "wal_level = replica" >> /tmp/primary/postgresql.conf
+  pg_ctl -D /tmp/primary -o "-p 5432 -k /tmp" start
+  pg_basebackup -h /tmp -p 5432 -U postgres -D /tmp/replica -R
+  pg_ctl -D /tmp/replica -o "-p 5433 -k /tmp" start
+  python replica_routing.py --primary "host=/tmp port=5432 dbname=postgres user=postgres" \\
+                            --replica "host=/tmp port=5433 dbname=postgres user=postgres"
+"""
+
+
+def primary_settings(dsn):
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return {
+        'DB_HOST': params.get('host', 'localhost'),
+        'DB_PORT': params.get('port', '5432'),
+        'DB_NAME': params.get('dbname', 'postgres'),
+        'DB_USER': params.get('user', 'postgres'),
+        'DB_PASSWORD': params.get('password', ''),
+        'DB_SSLMODE': params.get('sslmode', 'prefer'),
+    }
+
+
+def scalar(conn, query):
+    c = conn.cursor()
+    c.execute(query)
+    value = c.fetchone()[0]
+    c.close()
+    return value
+
+
+def wait_for_replay(primary, replica, timeout):
+    target = scalar(primary, "SELECT pg_current_wal_lsn()::text")
+    deadline = time.monotonic() + timeout
+    while scalar(replica, f"SELECT pg_last_wal_replay_lsn() >= '{target}'::pg_lsn") is not True:
+        if time.monotonic() > deadline:
+            raise SystemExit(f"replica did not replay up to {target} within {timeout:.0f}s")
+        time.sleep(0.05)
+
+
+def create_customer():
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM users WHERE email = %s", (EMAIL,))
+        c.execute("INSERT INTO users (name, email, password) VALUES (%s, %s, %s) RETURNING id", ('Routing Check', EMAIL, 'x'))
+        user_id = c.fetchone()['id']
+        c.execute("INSERT INTO customers (user_id, name) VALUES (%s, %s) RETURNING id", (user_id, 'Routing Check'))
+        customer_id = c.fetchone()['id']
+        conn.commit()
+    return customer_id
+
+
+def drop_customer():
+    with records.get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM users WHERE email = %s", (EMAIL,))
+        conn.commit()
+
+
+def read_count(customer_id, session):
+    # Bypasses the read cache so every call goes through the router.
+    records.bind_session(session)
+    router = records.get_router()
+    before = router.stats()
+    count = records.get_summary.__wrapped__(customer_id).count
+    after = router.stats()
+    moved = [name for name in ('replica_reads', 'own_write_fallbacks', 'lag_fallbacks', 'unavailable_fallbacks')
+             if after[name] > before[name]]
+    return count, moved
+
+
+def check(name, ok, detail):
+    print(f"{name:<44}{'ok' if ok else 'FAIL'}  {detail}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check read routing against a primary and a streaming replica: "
+                                                 "read-your-writes, replica reads, and lag fallback.",
+                                     epilog=SETUP, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--primary', required=True, help="libpq DSN of the primary")
+    parser.add_argument('--replica', required=True, help="libpq DSN of a streaming replica of it; needs rights to "
+                                                         "pause WAL replay")
+    parser.add_argument('--max-lag', type=float, default=2.0, help="REPLICA_MAX_LAG for the run, in seconds")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for the replica to catch up")
+    args = parser.parse_args()
+
+    records.configure({
+        **primary_settings(args.primary),
+        'DB_REPLICAS': [args.replica],
+        'REPLICA_MAX_LAG': args.max_lag,
+        'REPLICA_CHECK_INTERVAL': 0.1,
+        'REPLICA_RETRY_AFTER': 1,
+        'DB_POOL_MIN': 1,
+        'DB_POOL_MAX': 4,
+    })
+    records.init_db()
+    if records.get_router() is None:
+        raise SystemExit("no replica configured")
+    primary = psycopg2.connect(args.primary)
+    primary.autocommit = True
+    replica = psycopg2.connect(args.replica)
+    replica.autocommit = True
+    if not scalar(replica, "SELECT pg_is_in_recovery()"):
+        raise SystemExit("--replica is not a standby")
+
+    customer_id = create_customer()
+    results = []
+    try:
+        # A fresh commit replayed just before pausing keeps the measured lag near zero until the clock runs on.
+        records.add_transaction(customer_id, 'Received', 10, 10, 0, 'routing check')
+        wait_for_replay(primary, replica, args.timeout)
+        scalar(replica, "SELECT pg_wal_replay_pause()")
+        try:
+            writer = records.new_session()
+            records.bind_session(writer)
+            records.add_transaction(customer_id, 'Given', 5, 0, 5, 'routing check')
+            paused_at = time.monotonic()
+
+            count, moved = read_count(customer_id, writer)
+            results.append(check("writer reads its own write from the primary", count == 2 and moved == ['own_write_fallbacks'],
+                                 f"count={count} routed={moved}"))
+            count, moved = read_count(customer_id, records.new_session())
+            elapsed = time.monotonic() - paused_at
+            results.append(check("other session reads from the replica", count == 1 and moved == ['replica_reads'],
+                                 f"count={count} routed={moved} after {elapsed:.2f}s paused"))
+
+            time.sleep(max(0.0, args.max_lag + 0.5 - (time.monotonic() - paused_at)))
+            count, moved = read_count(customer_id, records.new_session())
+            lag = records.get_router().stats()['replicas'][0]['lag_s']
+            results.append(check("reads fall back once lag passes the limit", count == 2 and moved == ['lag_fallbacks'],
+                                 f"count={count} routed={moved} lag={lag:.2f}s"))
+        finally:
+            scalar(replica, "SELECT pg_wal_replay_resume()")
+
+        wait_for_replay(primary, replica, args.timeout)
+        time.sleep(0.2)
+        count, moved = read_count(customer_id, records.new_session())
+        results.append(check("reads return to the replica after catch-up", count == 2 and moved == ['replica_reads'],
+                             f"count={count} routed={moved}"))
+    finally:
+        drop_customer()
+    if not all(results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReadCache:
+    def __init__(self, maxsize=1024, ttl=300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+    def _current(self, scopes):
+        return tuple(self._versions.get(scope, 0) for scope in scopes)
+
+    def get_or_load(self, key, scopes, loader, keep=None):
+        with self._lock:
+            versions = self._current(scopes)
+            full_key = (key, versions)
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                expires, value = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(full_key)
+                    self._counters['hits'] += 1
+                    return value
+                del self._entries[full_key]
+                self._counters['expirations'] += 1
+            self._counters['misses'] += 1
+
+        value = loader()
+
+        with self._lock:
+            # A write landed while we were loading; the result may predate it.
+            if self._current(scopes) == versions and (keep is None or keep(value)):
+                self._entries[full_key] = (time.monotonic() + self.ttl, value)
+                self._entries.move_to_end(full_key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._counters['evictions'] += 1
+        return value
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+            self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(settings):
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ReadCache(
+                    maxsize=int(settings.get("READ_CACHE_SIZE", 1024)),
+                    ttl=float(settings.get("READ_CACHE_TTL", 300)),
+                )
+    return _cache
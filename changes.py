@@ -0,0 +1,113 @@
+import select
+import threading
+import time
+
+import psycopg2
+
+import routing
+
+CHANNEL = 'transaction_changes'
+
+
+class ChangeListener:
+    # One per process: a dedicated connection LISTENs for committed transaction writes and records, per customer, how many
+    # changes have been seen and the WAL position that covers them. Sessions compare against this instead of polling.
+    def __init__(self, connect, on_change, on_resync, retry_after=5.0, poll_interval=5.0):
+        self._connect = connect
+        self._on_change = on_change
+        self._on_resync = on_resync
+        self.retry_after = retry_after
+        self.poll_interval = poll_interval
+        self.connected = False
+        self._lock = threading.Lock()
+        self._changes = {}
+        self._resyncs = 0
+        self._counters = {'notifications': 0, 'customers_changed': 0, 'reconnects': 0, 'errors': 0}
+        self._thread = threading.Thread(target=self._run, name='change-listener', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def change(self, customer_id):
+        # (count, lsn): the count only grows, and also moves after a reconnect since notifications may have been missed.
+        with self._lock:
+            count, lsn = self._changes.get(customer_id, (0, None))
+            return count + self._resyncs, lsn
+
+    def _listen(self):
+        conn = self._connect()
+        conn.autocommit = True
+        c = conn.cursor()
+        c.execute(f"LISTEN {CHANNEL}")
+        c.close()
+        return conn
+
+    def _drain(self, conn):
+        conn.poll()
+        notifies, conn.notifies[:] = list(conn.notifies), []
+        customer_ids = {int(notify.payload) for notify in notifies}
+        if not customer_ids:
+            return
+        # Notifications arrive after commit, so the primary's current position covers every write they describe.
+        c = conn.cursor()
+        c.execute("SELECT pg_current_wal_lsn()::text AS lsn")
+        lsn = routing.parse_lsn(c.fetchone()['lsn'])
+        c.close()
+        self._on_change(customer_ids, lsn)
+        with self._lock:
+            for customer_id in customer_ids:
+                count, _ = self._changes.get(customer_id, (0, None))
+                self._changes[customer_id] = (count + 1, lsn)
+            self._counters['notifications'] += len(notifies)
+            self._counters['customers_changed'] += len(customer_ids)
+
+    def _run(self):
+        failed = False
+        while True:
+            conn = None
+            try:
+                conn = self._listen()
+                self.connected = True
+                if failed:
+                    # Anything committed while we weren't listening went unannounced.
+                    self._on_resync()
+                    with self._lock:
+                        self._resyncs += 1
+                        self._counters['reconnects'] += 1
+                while True:
+                    select.select([conn], [], [], self.poll_interval)
+                    self._drain(conn)
+            except (psycopg2.Error, OSError):
+                with self._lock:
+                    self._counters['errors'] += 1
+            failed = True
+            self.connected = False
+            if conn is not None:
+                try:
+                    conn.close()
+                except psycopg2.Error:
+                    pass
+            time.sleep(self.retry_after)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(connected=self.connected, customers=len(self._changes))
+        return stats
+
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_listener(connect, on_change, on_resync, settings):
+    global _listener
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                _listener = ChangeListener(
+                    connect, on_change, on_resync,
+                    retry_after=float(settings.get("CHANGE_LISTENER_RETRY_AFTER", 5)),
+                ).start()
+    return _listener
@@ -0,0 +1,231 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor
+
+
+class PoolError(Exception):
+    pass
+
+
+class ConnectionPool:
+    errors = (psycopg2.Error,)
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=30.0, check_after=60.0):
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = max(minconn, maxconn)
+        self.timeout = timeout
+        self.check_after = check_after
+        self._cond = threading.Condition()
+        self._idle = []
+        self._size = 0
+        self._in_use = 0
+        self._counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'connect_time': 0.0,
+            'reconnects': 0,
+        }
+        for _ in range(minconn):
+            self._idle.append((self._open(), time.monotonic()))
+            self._size += 1
+
+    def _open(self):
+        started = time.perf_counter()
+        try:
+            conn = self._connect()
+        except self.errors as e:
+            raise PoolError(str(e).strip()) from e
+        elapsed = time.perf_counter() - started
+        with self._cond:
+            self._counters['connects'] += 1
+            self._counters['connect_time'] += elapsed
+        return conn
+
+    def _is_closed(self, conn):
+        return bool(conn.closed)
+
+    def _in_transaction(self, conn):
+        return conn.info.transaction_status != TRANSACTION_STATUS_IDLE
+
+    def _is_alive(self, conn):
+        if self._is_closed(conn):
+            return False
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1")
+            c.close()
+            conn.rollback()
+            return True
+        except self.errors:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except self.errors:
+            pass
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        waited_since = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    conn, last_used = None, None
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolError(f"No database connection available after {self.timeout:.0f}s")
+                if waited_since is None:
+                    waited_since = time.monotonic()
+                    self._counters['waits'] += 1
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._counters['checkouts'] += 1
+            if waited_since is not None:
+                self._counters['wait_time'] += time.monotonic() - waited_since
+
+        try:
+            if conn is None:
+                conn = self._open()
+            elif self._is_closed(conn) or (time.monotonic() - last_used > self.check_after and not self._is_alive(conn)):
+                self._close_quietly(conn)
+                conn = self._open()
+                with self._cond:
+                    self._counters['reconnects'] += 1
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn):
+        keep = not self._is_closed(conn)
+        if keep and self._in_transaction(conn):
+            try:
+                conn.rollback()
+            except self.errors:
+                keep = False
+        if not keep:
+            self._close_quietly(conn)
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        with self.lease(self.getconn()) as conn:
+            yield conn
+
+    @contextmanager
+    def lease(self, conn):
+        try:
+            yield conn
+        except Exception:
+            if not self._is_closed(conn):
+                try:
+                    conn.rollback()
+                except self.errors:
+                    pass
+            raise
+        finally:
+            self.putconn(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update(size=self._size, in_use=self._in_use, idle=len(self._idle),
+                         minconn=self.minconn, maxconn=self.maxconn)
+        stats['avg_connect_ms'] = (stats['connect_time'] / stats['connects'] * 1000) if stats['connects'] else 0.0
+        stats['avg_wait_ms'] = (stats['wait_time'] / stats['waits'] * 1000) if stats['waits'] else 0.0
+        return stats
+
+    def closeall(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def primary_connect(settings, cursor_factory=RealDictCursor):
+    return partial(
+        psycopg2.connect,
+        host=settings["DB_HOST"],
+        database=settings["DB_NAME"],
+        user=settings["DB_USER"],
+        password=settings["DB_PASSWORD"],
+        port=settings["DB_PORT"],
+        sslmode=settings["DB_SSLMODE"],
+        cursor_factory=cursor_factory,
+        keepalives=1,
+        keepalives_idle=30,
+    )
+
+
+def get_pool(settings, cursor_factory=RealDictCursor):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    primary_connect(settings, cursor_factory),
+                    minconn=int(settings.get("DB_POOL_MIN", 1)),
+                    maxconn=int(settings.get("DB_POOL_MAX", 10)),
+                    timeout=float(settings.get("DB_POOL_TIMEOUT", 30)),
+                    check_after=float(settings.get("DB_POOL_CHECK_AFTER", 60)),
+                )
+    return _pool
+
+
+_replica_pools = None
+
+
+def replica_name(dsn, index):
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return f"{params.get('host', f'replica{index}')}:{params.get('port', 5432)}"
+
+
+def get_replica_pools(settings, cursor_factory=RealDictCursor):
+    # DB_REPLICAS is a libpq connection string or URI, or a list of them. Replica pools start empty so
+    # an unreachable replica doesn't stop the app from starting.
+    global _replica_pools
+    if _replica_pools is None:
+        with _pool_lock:
+            if _replica_pools is None:
+                dsns = settings.get("DB_REPLICAS", [])
+                if isinstance(dsns, str):
+                    dsns = [dsns]
+                _replica_pools = [(replica_name(dsn, i), ConnectionPool(
+                    partial(psycopg2.connect, dsn, cursor_factory=cursor_factory, keepalives=1, keepalives_idle=30,
+                            connect_timeout=int(settings.get("REPLICA_CONNECT_TIMEOUT", 2))),
+                    minconn=0,
+                    maxconn=int(settings.get("DB_POOL_MAX", 10)),
+                    timeout=float(settings.get("DB_POOL_TIMEOUT", 30)),
+                    check_after=float(settings.get("DB_POOL_CHECK_AFTER", 60)),
+                )) for i, dsn in enumerate(dsns)]
+    return _replica_pools
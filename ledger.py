@@ -0,0 +1,101 @@
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+
+COLUMNS = ('id', 'date_time', 'type', 'total_amount', 'amount_received', 'amount_left', 'note')
+AMOUNT_COLUMNS = ('total_amount', 'amount_received', 'amount_left')
+
+_format_amount = np.frompyfunc(lambda value: f"{(value or 0):,.2f}", 1, 1)
+
+
+def _to_decimal(value):
+    if value is None or isinstance(value, Decimal):
+        return value
+    return Decimal(value)
+
+
+def _amounts(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = [_to_decimal(value) for value in values]
+    return array
+
+
+def _objects(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+class Transactions:
+    def __init__(self, ids, date_times, types, total_amounts, amounts_received, amounts_left, notes, archived=None):
+        self.id = np.asarray(ids, dtype=np.int64)
+        self.date_time = np.asarray(date_times, dtype='datetime64[us]')
+        self.type = np.asarray(types, dtype='<U8')
+        self.total_amount = _amounts(total_amounts)
+        self.amount_received = _amounts(amounts_received)
+        self.amount_left = _amounts(amounts_left)
+        self.note = _objects(notes)
+        # Rows read back from archive files; those months are read-only.
+        self.archived = np.zeros(len(self.id), dtype=bool) if archived is None else np.asarray(archived, dtype=bool)
+        self._positions = {trans_id: i for i, trans_id in enumerate(self.id.tolist())}
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = list(rows)
+        if rows and isinstance(rows[0], dict):
+            return cls(*([row[column] for row in rows] for column in COLUMNS),
+                       archived=[row.get('archived', False) for row in rows])
+        return cls(*([row[i] for row in rows] for i in range(len(COLUMNS))))
+
+    @classmethod
+    def from_cursor(cls, cursor):
+        return cls.from_rows(cursor.fetchall())
+
+    def __len__(self):
+        return len(self.id)
+
+    def __bool__(self):
+        return len(self.id) > 0
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Transactions(*(getattr(self, column)[index] for column in COLUMNS), archived=self.archived[index])
+        return self.row(index)
+
+    def row(self, i):
+        return (int(self.id[i]), self.date_time[i].astype(datetime), str(self.type[i]),
+                self.total_amount[i], self.amount_received[i], self.amount_left[i], self.note[i])
+
+    def get(self, trans_id):
+        i = self._positions.get(trans_id)
+        return None if i is None else self.row(i)
+
+    def is_archived(self, trans_id):
+        i = self._positions.get(trans_id)
+        return i is not None and bool(self.archived[i])
+
+    def last_key(self):
+        return (self.date_time[-1].astype(datetime), int(self.id[-1]))
+
+    def received_mask(self):
+        return self.type == 'Received'
+
+    def type_labels(self, received, given):
+        return np.where(self.received_mask(), received, given)
+
+    def formatted_dates(self):
+        if not len(self):
+            return np.array([], dtype=str)
+        return np.char.replace(np.datetime_as_string(self.date_time, unit='s'), 'T', ' ')
+
+    def formatted_amounts(self, column):
+        return _format_amount(getattr(self, column)).astype(str)
+
+    def formatted_notes(self, placeholder=""):
+        missing = np.equal(self.note, None) | np.equal(self.note, '')
+        return np.where(missing, placeholder, self.note).astype(str)
@@ -0,0 +1,67 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHM = 'pbkdf2_sha256'
+LEGACY_SALT = b'money_records_salt_2024'
+LEGACY_ITERATIONS = 100000
+
+PasswordHash = namedtuple('PasswordHash', ['algorithm', 'iterations', 'salt', 'hash'])
+
+
+def derive(password, salt, iterations):
+    return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations).hex()
+
+
+# A concurrency cap, not an async API: hash() and verify() still block the calling thread until
+# its derivation is done. The pool only bounds how many PBKDF2 runs share the CPU at once, so a
+# burst of logins cannot starve page renders and API requests (see benchmarks/login_throughput.py).
+class PasswordHasher:
+    def __init__(self, iterations=LEGACY_ITERATIONS, workers=4):
+        self.iterations = iterations
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+
+    def hash(self, password):
+        salt = os.urandom(16)
+        digest = self._executor.submit(derive, password, salt, self.iterations).result()
+        return PasswordHash(ALGORITHM, self.iterations, salt.hex(), digest)
+
+    def verify(self, password, stored):
+        if stored.algorithm is None:
+            salt, iterations = LEGACY_SALT, LEGACY_ITERATIONS
+        elif stored.algorithm == ALGORITHM:
+            salt, iterations = bytes.fromhex(stored.salt), stored.iterations
+        else:
+            return False
+        digest = self._executor.submit(derive, password, salt, iterations).result()
+        return hmac.compare_digest(digest, stored.hash)
+
+    def dummy(self):
+        # Verified against for unknown emails, so a miss costs as much as a wrong password.
+        return PasswordHash(ALGORITHM, self.iterations, '00' * 16, '0' * 64)
+
+    def needs_rehash(self, stored):
+        return stored.algorithm != ALGORITHM or stored.iterations != self.iterations
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_hasher(settings):
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher(
+                    iterations=int(settings.get("PASSWORD_ITERATIONS", LEGACY_ITERATIONS)),
+                    workers=int(settings.get("PASSWORD_HASH_WORKERS", 4)),
+                )
+    return _hasher
@@ -0,0 +1,121 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytz
+
+LOCAL_TIMEZONE = pytz.timezone('Asia/Karachi')
+
+Summary = namedtuple('Summary', ['received', 'given', 'balance', 'outstanding', 'count'])
+PageData = namedtuple('PageData', ['customers', 'customer_total', 'customer_name', 'transactions', 'has_more', 'summary', 'today',
+                                   'months'])
+# What a backend loads for the customer screen before archived rows are merged in; rows holds up to limit + 1 rows.
+PageRows = namedtuple('PageRows', ['customers', 'customer_total', 'customer_name', 'rows', 'summary', 'today', 'months',
+                                   'archive'])
+MonthTotal = namedtuple('MonthTotal', ['month', 'received', 'given', 'pending', 'count'])
+
+CUSTOMER_SEARCH_LIMIT = 20
+
+SUMMARY_EXPRESSIONS = [
+    "COALESCE(SUM(total_amount) FILTER (WHERE type = 'Received'), 0)",
+    "COALESCE(SUM(total_amount) FILTER (WHERE type = 'Given'), 0)",
+    "COALESCE(SUM(CASE WHEN type = 'Received' THEN total_amount ELSE -total_amount END), 0)",
+    "COALESCE(SUM(amount_left), 0)",
+]
+
+
+def get_local_time():
+    return datetime.now(LOCAL_TIMEZONE)
+
+
+def date_range_bounds(start_date, end_date):
+    start = datetime.strptime(str(start_date), '%Y-%m-%d')
+    end = datetime.strptime(str(end_date), '%Y-%m-%d') + timedelta(days=1)
+    return start, end
+
+
+def month_bounds(month):
+    start = datetime.strptime(month, '%Y-%m')
+    end = (start + timedelta(days=32)).replace(day=1)
+    return start, end
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def filter_bounds(start_date=None, end_date=None):
+    if start_date and end_date:
+        return date_range_bounds(start_date, end_date)
+    return None, None
+
+
+def to_decimal(value):
+    return Decimal(value) if value is not None else None
+
+
+def transaction_filter(customer_id, start_date=None, end_date=None):
+    conditions = ["customer_id = %s"]
+    params = [customer_id]
+    if start_date and end_date:
+        conditions.append("date_time >= %s AND date_time < %s")
+        params.extend(date_range_bounds(start_date, end_date))
+    return conditions, params
+
+
+def after_filter(conditions, params, after):
+    # Keyset paging, newest first: rows strictly older than the last one already shown.
+    if not after:
+        return conditions, params
+    return [*conditions, "(date_time, id) < (%s, %s)"], [*params, *after]
+
+
+def archive_filter(start=None, end=None):
+    conditions = ["TRUE"]
+    params = []
+    if start is not None:
+        conditions.append("month >= %s")
+        params.append(month_start(start))
+    if end is not None:
+        conditions.append("month < %s")
+        params.append(end)
+    return conditions, params
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def customer_matches_query(backend, user_id, term="", limit=CUSTOMER_SEARCH_LIMIT):
+    term = (term or "").strip()
+    conditions = ["user_id = %s"]
+    params = [user_id]
+    prefix = "TRUE"
+    prefix_params = []
+    if term:
+        pattern = escape_like(term)
+        conditions.append(backend.like("name"))
+        params.append(f"%{pattern}%")
+        prefix = backend.like("name")
+        prefix_params.append(f"{pattern}%")
+    if limit is None:
+        limit = backend.unlimited
+    query = f"""SELECT id, name, {prefix} AS prefix FROM customers WHERE {' AND '.join(conditions)}
+                ORDER BY prefix DESC, name, id LIMIT %s"""
+    return query, [*prefix_params, *params, limit]
+
+
+def month_totals_query(backend):
+    return f"""SELECT {backend.month_label('month')} AS label, received, given, pending, transaction_count
+               FROM customer_months WHERE customer_id = %s AND transaction_count > 0
+               ORDER BY month"""
+
+
+def month_total(row):
+    return MonthTotal(row['label'], to_decimal(row['received']), to_decimal(row['given']), to_decimal(row['pending']),
+                      row['transaction_count'])
@@ -0,0 +1,784 @@
+import csv
+import heapq
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from functools import wraps
+from itertools import islice
+
+import psycopg2
+
+import backends
+import cache
+import db
+import passwords
+import routing
+import tracing
+from queries import (CUSTOMER_SEARCH_LIMIT, LOCAL_TIMEZONE, SUMMARY_EXPRESSIONS, PageData, Summary, add_months, after_filter,
+                     date_range_bounds, escape_like, filter_bounds, get_local_time, month_bounds, month_start, month_total,
+                     month_totals_query, to_decimal, transaction_filter)
+
+_settings = {}
+_on_connection_error = None
+_schema_ready = False
+_schema_lock = threading.Lock()
+_reads = threading.local()
+
+EXPORT_COLUMNS = ['ID', 'Date & Time', 'Type', 'Total Amount', 'Amount Received', 'Amount Left', 'Note']
+STATEMENT_COLUMNS = [*EXPORT_COLUMNS, 'Balance', 'Pending Balance']
+EXPORT_CHUNK_SIZE = 5000
+IMPORT_BATCH_SIZE = 5000
+IMPORT_REQUIRED_COLUMNS = ['Date & Time', 'Type', 'Total Amount', 'Amount Received', 'Amount Left']
+
+StatementPage = namedtuple('StatementPage', ['transactions', 'balance', 'pending', 'opening', 'has_more'])
+
+BALANCE_SORTS = {
+    "Name": "c.name",
+    "Net Balance": "net",
+    "Pending": "pending",
+    "Received": "received",
+    "Given": "given",
+    "Transactions": "transaction_count",
+}
+
+def configure(settings, on_connection_error=None):
+    global _settings, _on_connection_error
+    _settings = settings
+    _on_connection_error = on_connection_error
+
+def connection_failed(error):
+    if _on_connection_error is None:
+        raise error
+    _on_connection_error(error)
+
+def get_backend():
+    return backends.get_backend(_settings)
+
+def get_pool():
+    try:
+        return get_backend().pool()
+    except Exception as e:
+        connection_failed(e)
+
+@contextmanager
+def get_db_connection():
+    try:
+        started = time.perf_counter()
+        with get_pool().connection() as conn:
+            tracing.record_checkout(time.perf_counter() - started)
+            yield conn
+    except db.PoolError as e:
+        connection_failed(e)
+
+def get_router():
+    return get_backend().router()
+
+def new_session():
+    return routing.Session()
+
+def bind_session(session):
+    routing.bind(session)
+
+@contextmanager
+def get_read_connection():
+    router = get_router()
+    started = time.perf_counter()
+    routed = router.acquire() if router else None
+    if routed is None:
+        with get_db_connection() as conn:
+            yield conn
+        return
+    replica, conn, cacheable = routed
+    tracing.record_checkout(time.perf_counter() - started)
+    if not cacheable:
+        _reads.stale = True
+    with replica.pool.lease(conn):
+        yield conn
+
+@contextmanager
+def get_write_connection():
+    with get_db_connection() as conn:
+        yield conn
+        router = get_router()
+        if router:
+            # Reads from this session stay on the primary until a replica has replayed past this point.
+            c = conn.cursor()
+            c.execute("SELECT pg_current_wal_lsn()::text AS lsn")
+            router.note_write(c.fetchone()['lsn'])
+            conn.rollback()
+
+def get_cache():
+    return cache.get_cache(_settings)
+
+def customers_changed(customer_ids, lsn):
+    # Another session (or process) committed these; replica reads that predate it must not be cached.
+    router = get_router()
+    if router:
+        router.note_change(lsn)
+    get_cache().bump(*(('customer', customer_id) for customer_id in customer_ids))
+
+def get_change_listener():
+    return get_backend().change_listener(customers_changed, get_cache().clear)
+
+def get_customer_change(customer_id):
+    listener = get_change_listener()
+    return listener.change(customer_id) if listener else None
+
+def follow_change(session, change):
+    # The session's next reads must see the change it was told about, so replicas that haven't replayed it are skipped.
+    routing.require(session, change[1])
+
+def user_scope(user_id, *args, **kwargs):
+    return [('user', user_id)]
+
+def customer_scope(customer_id, *args, **kwargs):
+    return [('customer', customer_id)]
+
+def page_scope(user_id, customer_id, *args, **kwargs):
+    return [('user', user_id), ('customer', customer_id)]
+
+def cached_read(scopes):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            loaded = {}
+            def load():
+                outer = getattr(_reads, 'stale', False)
+                _reads.stale = False
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    loaded['stale'] = _reads.stale
+                    _reads.stale = outer or _reads.stale
+            # A replica behind this process's own writes must not fill the shared cache with old rows.
+            return get_cache().get_or_load(key, scopes(*args, **kwargs), load, keep=lambda value: not loaded['stale'])
+        return wrapper
+    return decorator
+
+def get_hasher():
+    return passwords.get_hasher(_settings)
+
+def get_tracer():
+    return tracing.get_tracer(_settings)
+
+def archive_dir():
+    return _settings.get("ARCHIVE_DIR", "archive")
+
+def ensure_schema():
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            init_db()
+            current = month_start(get_local_time())
+            ensure_partitions(add_months(current, n) for n in range(int(_settings.get("PARTITION_MONTHS_AHEAD", 3)) + 1))
+            _schema_ready = True
+
+def ensure_partitions(dates):
+    get_backend().ensure_partitions(get_db_connection, dates)
+
+class MigrationRequired(Exception):
+    def __init__(self, version):
+        super().__init__(f"Schema migration {version} rewrites the transactions table and has to be run during a "
+                         f"maintenance window: python archive.py --migrate")
+        self.version = version
+
+def init_db(maintenance=False):
+    backend = get_backend()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        # Another process may already have set everything up; one lookup avoids the DDL and its locks.
+        current = backend.schema_version(c)
+        conn.rollback()
+        if current >= backend.latest_version():
+            return
+        pending = backend.migrate(c, maintenance)
+        conn.commit()
+        if pending:
+            raise MigrationRequired(pending)
+        try:
+            c.execute("SELECT * FROM users WHERE email = %s", ('admin@example.com',))
+            if not c.fetchone():
+                hashed = get_hasher().hash('admin123')
+                c.execute("""INSERT INTO users (name, email, password, password_algorithm, password_iterations, password_salt)
+                             VALUES (%s, %s, %s, %s, %s, %s)""",
+                          ('Admin User', 'admin@example.com', hashed.hash, hashed.algorithm, hashed.iterations, hashed.salt))
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+
+def register_user(name, email, password):
+    hashed = get_hasher().hash(password)
+    with get_write_connection() as conn:
+        try:
+            c = conn.cursor()
+            c.execute("""INSERT INTO users (name, email, password, password_algorithm, password_iterations, password_salt)
+                         VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
+                      (name, email, hashed.hash, hashed.algorithm, hashed.iterations, hashed.salt))
+            result = c.fetchone()
+            user_id = result['id']
+            conn.commit()
+            return True, user_id, name
+        except (psycopg2.IntegrityError, sqlite3.IntegrityError):
+            conn.rollback()
+            return False, None, None
+        except Exception as e:
+            conn.rollback()
+            return False, None, None
+
+def login_user(email, password):
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT id, name, password, password_algorithm, password_iterations, password_salt
+                     FROM users WHERE email = %s""", (email,))
+        result = c.fetchone()
+    hasher = get_hasher()
+    if not result:
+        hasher.verify(password, hasher.dummy())
+        return False, None, None
+    stored = passwords.PasswordHash(result['password_algorithm'], result['password_iterations'],
+                                    result['password_salt'], result['password'])
+    if not hasher.verify(password, stored):
+        return False, None, None
+    if hasher.needs_rehash(stored):
+        hashed = hasher.hash(password)
+        with get_db_connection() as conn:
+            c = conn.cursor()
+            c.execute("""UPDATE users SET password = %s, password_algorithm = %s, password_iterations = %s, password_salt = %s
+                         WHERE id = %s AND password = %s""",
+                      (hashed.hash, hashed.algorithm, hashed.iterations, hashed.salt, result['id'], result['password']))
+            conn.commit()
+    return True, result['id'], result['name']
+
+@cached_read(user_scope)
+def get_customers(user_id):
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, name FROM customers WHERE user_id = %s ORDER BY name", (user_id,))
+        customers = c.fetchall()
+    return [(c['id'], c['name']) for c in customers]
+
+@cached_read(user_scope)
+def search_customers(user_id, term="", limit=CUSTOMER_SEARCH_LIMIT):
+    with get_read_connection() as conn:
+        return get_backend().search_customers(conn.cursor(), user_id, term, limit)
+
+BALANCE_COLUMNS = """c.id, c.name,
+                     COALESCE(b.received, 0) AS received,
+                     COALESCE(b.given, 0) AS given,
+                     COALESCE(b.received, 0) - COALESCE(b.given, 0) AS net,
+                     COALESCE(b.pending, 0) AS pending,
+                     COALESCE(b.transaction_count, 0) AS transaction_count"""
+
+def get_customer_balances(user_id, search="", sort="Name", descending=False, pending_only=False):
+    conditions = ["c.user_id = %s"]
+    params = [user_id]
+    search = (search or "").strip()
+    if search:
+        conditions.append(get_backend().like("c.name"))
+        params.append(f"%{escape_like(search)}%")
+    if pending_only:
+        conditions.append("COALESCE(b.pending, 0) <> 0")
+    order = f"{BALANCE_SORTS[sort]} {'DESC' if descending else 'ASC'}, c.name, c.id"
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {BALANCE_COLUMNS}
+                      FROM customers c LEFT JOIN customer_balances b ON b.customer_id = c.id
+                      WHERE {' AND '.join(conditions)}
+                      ORDER BY {order}""", params)
+        return c.fetchall()
+
+def id_list(ids):
+    return ", ".join(["%s"] * len(ids))
+
+@cached_read(user_scope)
+def get_owned_customers(user_id, customer_ids):
+    # customer_ids is a sorted tuple so equal requests share a cache entry.
+    if not customer_ids:
+        return frozenset()
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT id FROM customers WHERE user_id = %s AND id IN ({id_list(customer_ids)})", (user_id, *customer_ids))
+        return frozenset(row['id'] for row in c.fetchall())
+
+def balances_scope(user_id, customer_ids):
+    return [('user', user_id), *(('customer', customer_id) for customer_id in customer_ids)]
+
+@cached_read(balances_scope)
+def get_balances(user_id, customer_ids):
+    if not customer_ids:
+        return []
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {BALANCE_COLUMNS}
+                      FROM customers c LEFT JOIN customer_balances b ON b.customer_id = c.id
+                      WHERE c.user_id = %s AND c.id IN ({id_list(customer_ids)})
+                      ORDER BY c.id""", (user_id, *customer_ids))
+        return c.fetchall()
+
+def add_customer(user_id, name):
+    with get_write_connection() as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO customers (user_id, name) VALUES (%s, %s)", (user_id, name))
+        conn.commit()
+    get_cache().bump(('user', user_id))
+
+def archived_paths(c, start=None, end=None):
+    return [os.path.join(archive_dir(), name) for name in get_backend().archived_files(c, start, end)]
+
+def read_archived(paths, customer_id, start=None, end=None, after=None, limit=None, ascending=False):
+    if not paths:
+        return []
+    import archive
+    return archive.read_rows(paths, customer_id, start, end, after, limit, ascending)
+
+def transaction_key(row):
+    return row['date_time'], row['id']
+
+def merge_archived(live, archived):
+    # Both sides come sorted newest first; archived months can overlap live ones after a late import.
+    return list(heapq.merge(live, archived, key=transaction_key, reverse=True))
+
+def add_archived_summary(summary, paths, customer_id, start=None, end=None):
+    import archive
+    received, given, outstanding, count = archive.summarize(paths, customer_id, start, end)
+    return Summary(summary.received + received, summary.given + given, summary.balance + received - given,
+                   summary.outstanding + outstanding, summary.count + count)
+
+def get_transactions(customer_id, month_filter=None, start_date=None, end_date=None):
+    import ledger
+    start, end = filter_bounds(start_date, end_date)
+    if start is None and month_filter and month_filter != "All Months":
+        start, end = month_bounds(month_filter)
+    conditions = ["customer_id = %s"]
+    params = [customer_id]
+    if start is not None:
+        conditions.append("date_time >= %s AND date_time < %s")
+        params.extend((start, end))
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT id, date_time, type, total_amount, amount_received, amount_left, note
+                      FROM transactions WHERE {' AND '.join(conditions)}
+                      ORDER BY date_time DESC, id DESC""", params)
+        rows = c.fetchall()
+        paths = archived_paths(c, start, end)
+    if paths:
+        rows = merge_archived(rows, read_archived(paths, customer_id, start, end))
+    return ledger.Transactions.from_rows(rows)
+
+@cached_read(customer_scope)
+def get_transactions_page(customer_id, start_date=None, end_date=None, after=None, limit=50):
+    import ledger
+    conditions, params = after_filter(*transaction_filter(customer_id, start_date, end_date), after)
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT id, date_time, type, total_amount, amount_received, amount_left, note
+                      FROM transactions WHERE {' AND '.join(conditions)}
+                      ORDER BY date_time DESC, id DESC LIMIT %s""", (*params, limit + 1))
+        rows = c.fetchall()
+        start, end = filter_bounds(start_date, end_date)
+        paths = archived_paths(c, start, end)
+    if paths:
+        rows = merge_archived(rows, read_archived(paths, customer_id, start, end, after, limit + 1))[:limit + 1]
+    transactions = ledger.Transactions.from_rows(rows)
+    return transactions[:limit], len(transactions) > limit
+
+def get_transaction(trans_id):
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT id, date_time, type, total_amount, amount_received, amount_left, note
+                     FROM transactions WHERE id = %s""", (trans_id,))
+        t = c.fetchone()
+    if t is None:
+        return None
+    return (t['id'], t['date_time'], t['type'], t['total_amount'],
+            t['amount_received'], t['amount_left'], t['note'])
+
+@cached_read(customer_scope)
+def get_summary(customer_id, start_date=None, end_date=None):
+    conditions, params = transaction_filter(customer_id, start_date, end_date)
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        columns = ", ".join(f"{expression} AS {name}" for expression, name in zip(SUMMARY_EXPRESSIONS, Summary._fields))
+        c.execute(f"""SELECT {columns}, COUNT(*) AS count
+                      FROM transactions WHERE {' AND '.join(conditions)}""", params)
+        row = c.fetchone()
+        start, end = filter_bounds(start_date, end_date)
+        paths = archived_paths(c, start, end)
+    summary = Summary(row['received'], row['given'], row['balance'], row['outstanding'], row['count'])
+    if paths:
+        summary = add_archived_summary(summary, paths, customer_id, start, end)
+    return summary
+
+@cached_read(customer_scope)
+def get_opening_balance(customer_id, before):
+    # Whole months come from the rollup, which also covers archived months; only the days of before's own month are
+    # summed from rows.
+    month = month_start(before)
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT months.balance + days.balance AS balance, months.pending + days.pending AS pending
+                      FROM (SELECT COALESCE(SUM(received - given), 0) AS balance, COALESCE(SUM(pending), 0) AS pending
+                            FROM customer_months WHERE customer_id = %s AND month < %s) months,
+                           (SELECT {SUMMARY_EXPRESSIONS[2]} AS balance, {SUMMARY_EXPRESSIONS[3]} AS pending
+                            FROM transactions WHERE customer_id = %s AND date_time >= %s AND date_time < %s) days""",
+                  (customer_id, month.date(), customer_id, month, before))
+        row = c.fetchone()
+        paths = archived_paths(c, month, before)
+    balance, pending = to_decimal(row['balance']), to_decimal(row['pending'])
+    if paths:
+        import archive
+        received, given, archived_pending, _ = archive.summarize(paths, customer_id, month, before)
+        balance, pending = balance + received - given, pending + archived_pending
+    return balance, pending
+
+def statement_query(conditions):
+    # Running sums start at zero on the first row matched; callers add the balance carried in from before it.
+    return f"""SELECT id, date_time, type, total_amount, amount_received, amount_left, note,
+                      SUM(CASE WHEN type = 'Received' THEN total_amount ELSE -total_amount END) OVER running AS balance,
+                      SUM(COALESCE(amount_left, 0)) OVER running AS pending
+               FROM transactions WHERE {' AND '.join(conditions)}
+               WINDOW running AS (ORDER BY date_time, id ROWS UNBOUNDED PRECEDING)
+               ORDER BY date_time, id"""
+
+def with_opening(rows, balance, pending):
+    for row in rows:
+        yield {**row, 'balance': balance + to_decimal(row['balance']), 'pending': pending + to_decimal(row['pending'])}
+
+def running_totals(rows, balance, pending):
+    # The window can't see archived rows, so once they are merged in the sums are carried here instead.
+    for row in rows:
+        balance += row['total_amount'] if row['type'] == 'Received' else -row['total_amount']
+        pending += row['amount_left'] or 0
+        yield {**row, 'balance': balance, 'pending': pending}
+
+def opening_balance(customer_id, start):
+    return get_opening_balance(customer_id, start) if start else (Decimal(0), Decimal(0))
+
+@cached_read(customer_scope)
+def get_statement_page(customer_id, start_date=None, end_date=None, after=None, limit=50):
+    # Oldest first. A cursor carries the running totals at its row, so a later page starts from those rather than
+    # summing everything before it again.
+    import ledger
+    conditions, params = transaction_filter(customer_id, start_date, end_date)
+    start, end = filter_bounds(start_date, end_date)
+    if after:
+        *key, balance, pending = after
+        conditions.append("(date_time, id) > (%s, %s)")
+        params.extend(key)
+    else:
+        key = None
+        balance, pending = opening_balance(customer_id, start)
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"{statement_query(conditions)} LIMIT %s", (*params, limit + 1))
+        rows = c.fetchall()
+        paths = archived_paths(c, start, end)
+    if paths:
+        archived = read_archived(paths, customer_id, start, end, key, limit + 1, ascending=True)
+        rows = running_totals(heapq.merge(rows, archived, key=transaction_key), balance, pending)
+    else:
+        rows = with_opening(rows, balance, pending)
+    rows = list(islice(rows, limit + 1))
+    page = rows[:limit]
+    return StatementPage(ledger.Transactions.from_rows(page), [row['balance'] for row in page],
+                         [row['pending'] for row in page], (balance, pending), len(rows) > limit)
+
+def statement_cursor(page):
+    return (*page.transactions.last_key(), page.balance[-1], page.pending[-1])
+
+@cached_read(page_scope)
+def load_customer_page(user_id, customer_id, start_date=None, end_date=None, after=None, limit=50, today=None,
+                       search="", customer_limit=CUSTOMER_SEARCH_LIMIT):
+    import ledger
+    today = today or get_local_time().date()
+    with get_read_connection() as conn:
+        loaded = get_backend().load_customer_page(conn.cursor(), user_id, customer_id, start_date, end_date, after, limit,
+                                                  today, search, customer_limit)
+    rows, summary = loaded.rows, loaded.summary
+    if loaded.archive:
+        start, end = filter_bounds(start_date, end_date)
+        paths = [os.path.join(archive_dir(), name) for name in loaded.archive]
+        rows = merge_archived(rows, read_archived(paths, customer_id, start, end, after, limit + 1))[:limit + 1]
+        summary = add_archived_summary(summary, paths, customer_id, start, end)
+    transactions = ledger.Transactions.from_rows(rows)
+    return PageData(loaded.customers, loaded.customer_total, loaded.customer_name, transactions[:limit],
+                    len(transactions) > limit, summary, loaded.today, loaded.months)
+
+def fetch_rows(c):
+    while True:
+        rows = c.fetchmany(EXPORT_CHUNK_SIZE)
+        if not rows:
+            break
+        yield from rows
+
+def export_csv(out, customer_id, start_date=None, end_date=None):
+    conditions, params = transaction_filter(customer_id, start_date, end_date)
+    start, end = filter_bounds(start_date, end_date)
+    with get_read_connection() as conn:
+        paths = archived_paths(conn.cursor(), start, end)
+        if paths:
+            return export_csv_rows(out, conn, conditions, params, read_archived(paths, customer_id, start, end))
+        if not get_backend().copy_csv(conn.cursor(), out, conditions, params):
+            export_csv_rows(out, conn, conditions, params)
+
+def export_csv_rows(out, conn, conditions, params, archived=()):
+    # Used where COPY can't be: on SQLite, and when archived rows have to be merged in.
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+    # Same line endings as Postgres COPY, so an export doesn't depend on which path wrote it.
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    c = get_backend().stream_cursor(conn, 'export_csv', EXPORT_CHUNK_SIZE)
+    c.execute(f"""SELECT id, date_time, type, total_amount, amount_received, amount_left, note
+                  FROM transactions WHERE {' AND '.join(conditions)}
+                  ORDER BY date_time DESC, id DESC""", params)
+    rows = heapq.merge(fetch_rows(c), archived, key=transaction_key, reverse=True)
+    writer.writerows((row['id'], row['date_time'].strftime('%Y-%m-%d %H:%M:%S'), row['type'], row['total_amount'],
+                      row['amount_received'], row['amount_left'], row['note']) for row in rows)
+    c.close()
+    text.detach()
+
+def round_amounts(row, places=Decimal('0.01')):
+    return {**row, **{column: None if row[column] is None else row[column].quantize(places, rounding=ROUND_HALF_UP)
+                      for column in ('total_amount', 'amount_received', 'amount_left')}}
+
+def export_parquet(out, customer_id, start_date=None, end_date=None):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    amount = pa.decimal128(38, 2)
+    schema = pa.schema([('ID', pa.int64()), ('Date & Time', pa.timestamp('s')), ('Type', pa.string()),
+                        ('Total Amount', amount), ('Amount Received', amount), ('Amount Left', amount),
+                        ('Note', pa.string())])
+    conditions, params = transaction_filter(customer_id, start_date, end_date)
+    start, end = filter_bounds(start_date, end_date)
+    with get_read_connection() as conn:
+        archived = (round_amounts(row) for row in read_archived(archived_paths(conn.cursor(), start, end), customer_id,
+                                                                start, end))
+        c = get_backend().stream_cursor(conn, 'export_parquet', EXPORT_CHUNK_SIZE)
+        c.execute(f"""SELECT id, date_time, type, ROUND(total_amount, 2) AS total_amount,
+                             ROUND(amount_received, 2) AS amount_received, ROUND(amount_left, 2) AS amount_left, note
+                      FROM transactions WHERE {' AND '.join(conditions)}
+                      ORDER BY date_time DESC, id DESC""", params)
+        stream = heapq.merge(fetch_rows(c), archived, key=transaction_key, reverse=True)
+        with pq.ParquetWriter(out, schema, compression='zstd') as writer:
+            while True:
+                rows = list(islice(stream, EXPORT_CHUNK_SIZE))
+                if not rows:
+                    break
+                columns = [pa.array([row[key] for row in rows], type=field.type) for key, field in
+                           zip(('id', 'date_time', 'type', 'total_amount', 'amount_received', 'amount_left', 'note'), schema)]
+                writer.write_batch(pa.record_batch(columns, schema=schema))
+        c.close()
+
+def export_statement_csv(out, customer_id, start_date=None, end_date=None):
+    conditions, params = transaction_filter(customer_id, start_date, end_date)
+    start, end = filter_bounds(start_date, end_date)
+    balance, pending = opening_balance(customer_id, start)
+    text = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+    writer = csv.writer(text, lineterminator='\n')
+    writer.writerow(STATEMENT_COLUMNS)
+    if start:
+        writer.writerow(['', start.strftime('%Y-%m-%d %H:%M:%S'), 'Opening Balance', '', '', '', '', balance, pending])
+    with get_read_connection() as conn:
+        paths = archived_paths(conn.cursor(), start, end)
+        c = get_backend().stream_cursor(conn, 'export_statement', EXPORT_CHUNK_SIZE)
+        c.execute(statement_query(conditions), params)
+        if paths:
+            archived = read_archived(paths, customer_id, start, end, ascending=True)
+            rows = running_totals(heapq.merge(fetch_rows(c), archived, key=transaction_key), balance, pending)
+        else:
+            rows = with_opening(fetch_rows(c), balance, pending)
+        writer.writerows((row['id'], row['date_time'].strftime('%Y-%m-%d %H:%M:%S'), row['type'], row['total_amount'],
+                          row['amount_received'], row['amount_left'], row['note'], row['balance'], row['pending'])
+                         for row in rows)
+        c.close()
+    text.detach()
+
+def build_export(export_format, customer_id, start_date=None, end_date=None):
+    with tempfile.TemporaryFile() as out:
+        if export_format == "Parquet":
+            export_parquet(out, customer_id, start_date, end_date)
+        elif export_format == "Statement CSV":
+            export_statement_csv(out, customer_id, start_date, end_date)
+        else:
+            export_csv(out, customer_id, start_date, end_date)
+        out.seek(0)
+        return out.read()
+
+@cached_read(customer_scope)
+def get_today_transactions(customer_id, today=None):
+    today = today or get_local_time().date()
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT date_time, type, total_amount FROM transactions 
+                     WHERE customer_id = %s AND date_time >= %s AND date_time < %s ORDER BY date_time DESC""",
+                  (customer_id, *date_range_bounds(today, today)))
+        transactions = c.fetchall()
+    return [(t['date_time'], t['type'], t['total_amount']) for t in transactions]
+
+def add_transaction(customer_id, trans_type, total_amount, amount_received, amount_left, note):
+    now = get_local_time()
+    ensure_partitions([now])
+    with get_write_connection() as conn:
+        c = conn.cursor()
+        date_time = now.strftime('%Y-%m-%d %H:%M:%S')
+        c.execute("""INSERT INTO transactions (customer_id, date_time, type, total_amount, amount_received, amount_left, note)
+                     VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                  (customer_id, date_time, trans_type, total_amount, amount_received, amount_left, note))
+        conn.commit()
+    get_cache().bump(('customer', customer_id))
+
+def update_transaction(trans_id, trans_type, total_amount, amount_received, amount_left, note):
+    with get_write_connection() as conn:
+        c = conn.cursor()
+        c.execute("""UPDATE transactions SET type = %s, total_amount = %s, amount_received = %s, amount_left = %s, note = %s
+                     WHERE id = %s RETURNING customer_id""", (trans_type, total_amount, amount_received, amount_left, note, trans_id))
+        result = c.fetchone()
+        conn.commit()
+    if result:
+        get_cache().bump(('customer', result['customer_id']))
+    return result is not None
+
+def delete_transaction(trans_id):
+    with get_write_connection() as conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM transactions WHERE id = %s RETURNING customer_id", (trans_id,))
+        result = c.fetchone()
+        conn.commit()
+    if result:
+        get_cache().bump(('customer', result['customer_id']))
+    return result is not None
+
+def parse_amount(value, column, allow_negative=False):
+    try:
+        amount = Decimal((value or '').strip())
+    except InvalidOperation:
+        raise ValueError(f"{column} is not a number: {value!r}")
+    if not amount.is_finite():
+        raise ValueError(f"{column} is not a number: {value!r}")
+    if amount < 0 and not allow_negative:
+        raise ValueError(f"{column} must not be negative")
+    return amount
+
+def to_local_naive(date_time):
+    # Times are stored as naive local time; an explicit offset is converted to it, not dropped.
+    if date_time.tzinfo is not None:
+        date_time = date_time.astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
+    return date_time
+
+class ImportInterrupted(Exception):
+    def __init__(self, imported, rejected, error):
+        super().__init__(str(error).strip())
+        self.imported = imported
+        self.rejected = rejected
+
+def parse_import_row(row):
+    try:
+        date_time = datetime.fromisoformat((row['Date & Time'] or '').strip())
+    except ValueError:
+        raise ValueError(f"Date & Time is not a valid date: {row['Date & Time']!r}")
+    trans_type = (row['Type'] or '').strip()
+    if trans_type not in ('Received', 'Given'):
+        raise ValueError(f"Type must be 'Received' or 'Given', got {trans_type!r}")
+    total_amount = parse_amount(row['Total Amount'], 'Total Amount')
+    amount_received = parse_amount(row['Amount Received'], 'Amount Received')
+    amount_left = parse_amount(row['Amount Left'], 'Amount Left', allow_negative=True)
+    if total_amount <= 0:
+        raise ValueError("Total Amount must be greater than 0")
+    if amount_left != total_amount - amount_received:
+        raise ValueError(f"Amount Left must equal Total Amount - Amount Received ({total_amount - amount_received})")
+    note = (row.get('Note') or '').strip() or None
+    return to_local_naive(date_time), trans_type, total_amount, amount_received, amount_left, note
+
+def insert_transaction_rows(rows):
+    ensure_partitions(datetime.fromisoformat(str(row[1])) for row in rows)
+    with get_write_connection() as conn:
+        get_backend().insert_rows(conn.cursor(), rows)
+        conn.commit()
+    get_cache().bump(*{('customer', row[0]) for row in rows})
+
+def insert_transaction_batch(customer_id, batch):
+    insert_transaction_rows([(customer_id, *row) for row in batch])
+
+def import_transactions(customer_id, lines):
+    reader = csv.DictReader(lines)
+    missing = [column for column in IMPORT_REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+    imported = 0
+    rejected = []
+    batch = []
+    try:
+        for row in reader:
+            try:
+                batch.append(parse_import_row(row))
+            except ValueError as e:
+                rejected.append({'Line': reader.line_num, 'Reason': str(e), **{k: v for k, v in row.items() if k}})
+                continue
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                insert_transaction_batch(customer_id, batch)
+                imported += len(batch)
+                batch = []
+        if batch:
+            insert_transaction_batch(customer_id, batch)
+            imported += len(batch)
+    except get_pool().errors as e:
+        # Earlier batches are already committed, so the caller needs to know how far the import got.
+        raise ImportInterrupted(imported, rejected, e) from e
+    return imported, rejected
+
+def parse_entry_row(row):
+    trans_type = row.get('Type')
+    if trans_type not in ('Received', 'Given'):
+        raise ValueError(f"Type must be 'Received' or 'Given', got {trans_type!r}")
+    amounts = [None if row.get(column) is None else str(row[column]) for column in ('Total Amount', 'Amount Received')]
+    total_amount = parse_amount(amounts[0], 'Total Amount')
+    amount_received = parse_amount(amounts[1] or '0', 'Amount Received')
+    if total_amount <= 0:
+        raise ValueError("Total Amount must be greater than 0")
+    if amount_received > total_amount:
+        raise ValueError(f"Amount Received ({amount_received}) cannot be more than Total Amount ({total_amount})")
+    note = (row.get('Note') or '').strip() or None
+    return trans_type, total_amount, amount_received, total_amount - amount_received, note
+
+def add_transactions(customer_id, entries):
+    date_time = get_local_time().strftime('%Y-%m-%d %H:%M:%S')
+    insert_transaction_batch(customer_id, [(date_time, *entry) for entry in entries])
+
+@cached_read(customer_scope)
+def get_available_months(customer_id):
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {get_backend().month_label('month')} AS label FROM customer_months
+                      WHERE customer_id = %s AND transaction_count > 0 ORDER BY month DESC""", (customer_id,))
+        return [row['label'] for row in c.fetchall()]
+
+@cached_read(customer_scope)
+def get_month_totals(customer_id):
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(month_totals_query(get_backend()), (customer_id,))
+        return [month_total(row) for row in c.fetchall()]
+
+def get_monthly_report(user_id):
+    with get_read_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {get_backend().month_label('m.month')} AS month,
+                             SUM(m.received) AS received, SUM(m.given) AS given,
+                             SUM(m.received) - SUM(m.given) AS net, SUM(m.pending) AS pending,
+                             CAST(SUM(m.transaction_count) AS BIGINT) AS transaction_count,
+                             SUM(CASE WHEN m.transaction_count > 0 THEN 1 ELSE 0 END) AS customers
+                      FROM customer_months m JOIN customers c ON c.id = m.customer_id
+                      WHERE c.user_id = %s
+                      GROUP BY m.month HAVING SUM(m.transaction_count) > 0
+                      ORDER BY m.month DESC""", (user_id,))
+        return c.fetchall()
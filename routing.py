@@ -0,0 +1,155 @@
+import threading
+import time
+
+import db
+
+_local = threading.local()
+
+# On a standby with nothing left to replay, the last replay timestamp only shows how long the primary has been idle.
+REPLICA_STATE_QUERY = """
+    SELECT pg_last_wal_replay_lsn()::text AS lsn,
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END AS lag"""
+
+
+def parse_lsn(value):
+    if value is None:
+        return None
+    high, low = value.split('/')
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Session:
+    def __init__(self):
+        self.lsn = None
+
+
+def current_session():
+    return getattr(_local, 'session', None)
+
+
+def bind(session):
+    _local.session = session
+
+
+def require(session, lsn):
+    if session is not None and lsn is not None:
+        session.lsn = max(session.lsn or 0, lsn)
+
+
+class Replica:
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lsn = None
+        self.lag = None
+        self.checked = None
+        self.down_until = 0.0
+
+    def refresh(self, conn):
+        c = conn.cursor()
+        c.execute(REPLICA_STATE_QUERY)
+        row = c.fetchone()
+        c.close()
+        conn.rollback()
+        # A server that is not in recovery reports no replay position and never receives our writes.
+        self.lsn = parse_lsn(row['lsn'])
+        self.lag = float(row['lag']) if row['lsn'] is not None else None
+        self.checked = time.monotonic()
+
+
+class Router:
+    def __init__(self, replicas, max_lag=5.0, check_interval=1.0, retry_after=10.0):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.retry_after = retry_after
+        self.last_write_lsn = 0
+        self._lock = threading.Lock()
+        self._next = 0
+        self._counters = {'replica_reads': 0, 'own_write_fallbacks': 0, 'lag_fallbacks': 0, 'unavailable_fallbacks': 0,
+                          'replica_errors': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def note_change(self, lsn):
+        with self._lock:
+            self.last_write_lsn = max(self.last_write_lsn, lsn)
+
+    def note_write(self, lsn):
+        lsn = parse_lsn(lsn)
+        self.note_change(lsn)
+        require(current_session(), lsn)
+
+    def _rotation(self):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        return self.replicas[start:] + self.replicas[:start]
+
+    def acquire(self):
+        # Returns (replica, conn, cacheable) for a replica that is fresh enough for this session, or None for the primary.
+        # Results are only cacheable when the replica has every write made by this process, since the cache is shared.
+        session = current_session()
+        required = session.lsn if session is not None else None
+        fallback = 'unavailable_fallbacks'
+        for replica in self._rotation():
+            now = time.monotonic()
+            if replica.down_until > now:
+                continue
+            try:
+                conn = replica.pool.getconn()
+            except db.PoolError:
+                replica.down_until = now + self.retry_after
+                self._count('replica_errors')
+                continue
+            try:
+                if replica.checked is None or now - replica.checked >= self.check_interval:
+                    replica.refresh(conn)
+            except replica.pool.errors:
+                replica.pool.putconn(conn)
+                replica.down_until = now + self.retry_after
+                self._count('replica_errors')
+                continue
+            if replica.lsn is None or replica.lag > self.max_lag:
+                replica.pool.putconn(conn)
+                if fallback == 'unavailable_fallbacks':
+                    fallback = 'lag_fallbacks'
+                continue
+            if required is not None and replica.lsn < required:
+                replica.pool.putconn(conn)
+                fallback = 'own_write_fallbacks'
+                continue
+            self._count('replica_reads')
+            return replica, conn, replica.lsn >= self.last_write_lsn
+        self._count(fallback)
+        return None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats['replicas'] = [{'name': replica.name, 'lag_s': replica.lag, 'down': replica.down_until > time.monotonic()}
+                             for replica in self.replicas]
+        return stats
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router(settings, cursor_factory):
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                replicas = [Replica(name, pool) for name, pool in db.get_replica_pools(settings, cursor_factory)]
+                _router = Router(
+                    replicas,
+                    max_lag=float(settings.get("REPLICA_MAX_LAG", 5)),
+                    check_interval=float(settings.get("REPLICA_CHECK_INTERVAL", 1)),
+                    retry_after=float(settings.get("REPLICA_RETRY_AFTER", 10)),
+                ) if replicas else False
+    return _router or None
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import partial
+
+import db
+import tracing
+
+AMOUNT_PLACES = 6
+# Every column name, or alias, the queries use for an amount or a sum of amounts.
+AMOUNT_COLUMNS = frozenset({'total_amount', 'amount_received', 'amount_left', 'received', 'given', 'net', 'pending',
+                            'balance', 'outstanding'})
+
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+
+
+def amount(value):
+    # Rounded so binary float noise from SUM() does not leak into balances.
+    return Decimal(repr(round(value, AMOUNT_PLACES))) if isinstance(value, float) else Decimal(value)
+
+
+def dict_row(cursor, row):
+    # NUMERIC values come back as int or float depending on what was stored, and SQLite reports no type for
+    # SUM() and friends. Amounts are picked out by name instead, so they are Decimal like NUMERIC on Postgres.
+    values = {}
+    for column, value in zip(cursor.description, row):
+        if isinstance(value, float) or (column[0] in AMOUNT_COLUMNS and isinstance(value, int)):
+            value = amount(value)
+        values[column[0]] = value
+    return values
+
+
+def placeholders(sql):
+    return sql.replace('%s', '?').replace('%%', '%')
+
+
+class Cursor(sqlite3.Cursor):
+    _trace_entry = None
+    _trace_params = None
+
+    def execute(self, sql, parameters=()):
+        sql = placeholders(sql)
+        trace = tracing.current_trace()
+        if trace is None:
+            return super().execute(sql, parameters or ())
+        started = time.perf_counter()
+        super().execute(sql, parameters or ())
+        self._trace_entry = trace.record_query(sql, parameters, time.perf_counter() - started)
+        self._trace_params = parameters
+        if self.description is None:
+            self._trace_entry['rows'] = self.rowcount if self.rowcount >= 0 else None
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        sql = placeholders(sql)
+        trace = tracing.current_trace()
+        if trace is None:
+            return super().executemany(sql, seq_of_parameters)
+        seq_of_parameters = list(seq_of_parameters)
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._trace_entry = trace.record_query(sql, seq_of_parameters, time.perf_counter() - started)
+        self._trace_entry['rows'] = self.rowcount if self.rowcount >= 0 else None
+        return self
+
+    def _explain(self, sql, parameters):
+        c = self.connection.cursor(sqlite3.Cursor)
+        c.execute(f"EXPLAIN QUERY PLAN {sql}", parameters or ())
+        return "\n".join(row['detail'] for row in c.fetchall())
+
+    def _timed_fetch(self, fetch, *args):
+        trace = tracing.current_trace()
+        entry = self._trace_entry
+        if trace is None or entry is None:
+            return fetch(*args)
+        started = time.perf_counter()
+        rows = fetch(*args)
+        count = None if rows is None else (1 if isinstance(rows, dict) else len(rows))
+        trace.record_fetch(entry, time.perf_counter() - started, count)
+        # SQLite does most of a query's work while rows are fetched, so slowness is judged here.
+        if trace.explain and entry['explain'] is None and trace.is_slow(entry) and tracing.explainable(entry['sql']):
+            entry['explain'] = self._explain(entry['sql'], self._trace_params)
+        return rows
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size or self.arraysize)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class Connection(sqlite3.Connection):
+    def cursor(self, factory=Cursor):
+        return super().cursor(factory)
+
+
+def connect(path, timeout=5.0):
+    conn = sqlite3.connect(path, timeout=timeout, detect_types=sqlite3.PARSE_DECLTYPES,
+                           check_same_thread=False, factory=Connection)
+    conn.row_factory = dict_row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+class SQLitePool(db.ConnectionPool):
+    errors = (sqlite3.Error,)
+
+    def _is_closed(self, conn):
+        try:
+            conn.total_changes
+            return False
+        except sqlite3.ProgrammingError:
+            return True
+
+    def _in_transaction(self, conn):
+        return conn.in_transaction
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(settings):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SQLitePool(
+                    partial(connect, settings.get("SQLITE_PATH", "balance_records.db"),
+                            timeout=float(settings.get("SQLITE_BUSY_TIMEOUT", 5))),
+                    minconn=int(settings.get("DB_POOL_MIN", 1)),
+                    maxconn=int(settings.get("DB_POOL_MAX", 4)),
+                    timeout=float(settings.get("DB_POOL_TIMEOUT", 30)),
+                    check_after=float(settings.get("DB_POOL_CHECK_AFTER", 60)),
+                )
+    return _pool
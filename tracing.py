@@ -0,0 +1,228 @@
+import json
+import logging
+import re
+import sys
+import threading
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+logger = logging.getLogger('balance_recorder.trace')
+
+_local = threading.local()
+_WHITESPACE = re.compile(r'\s+')
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_MODIFYING = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|COPY)\b', re.IGNORECASE)
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def explainable(sql):
+    return bool(_EXPLAINABLE.match(sql)) and not _MODIFYING.search(sql)
+
+
+def normalize_sql(query):
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    return _WHITESPACE.sub(' ', str(query)).strip()
+
+
+def param_shape(params):
+    # Only types and sizes are kept; parameter values can hold passwords and notes.
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: param_shape(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        if isinstance(params, list):
+            return f"list[{len(params)}]"
+        return [param_shape(value) if isinstance(value, (list, tuple, dict)) else type(value).__name__
+                for value in params]
+    return type(params).__name__
+
+
+class Trace:
+    def __init__(self, rerun_id, slow_ms=200.0, explain=True):
+        self.rerun_id = rerun_id
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.started = time.perf_counter()
+        self.last_activity = self.started
+        self.elapsed = None
+        self.interrupted = False
+        self.queries = []
+        self.checkouts = 0
+        self.checkout_time = 0.0
+
+    def record_checkout(self, seconds):
+        self.checkouts += 1
+        self.checkout_time += seconds
+        self.last_activity = time.perf_counter()
+
+    def record_query(self, query, params, execute_time):
+        entry = {
+            'rerun_id': self.rerun_id,
+            'seq': len(self.queries) + 1,
+            'sql': normalize_sql(query),
+            'params': param_shape(params),
+            'rows': None,
+            'execute_ms': execute_time * 1000,
+            'fetch_ms': 0.0,
+            'explain': None,
+        }
+        self.queries.append(entry)
+        self.last_activity = time.perf_counter()
+        return entry
+
+    def record_fetch(self, entry, seconds, rows):
+        entry['fetch_ms'] += seconds * 1000
+        if rows is not None:
+            entry['rows'] = (entry['rows'] or 0) + rows
+        self.last_activity = time.perf_counter()
+
+    def is_slow(self, entry):
+        return entry['execute_ms'] + entry['fetch_ms'] >= self.slow_ms
+
+    def finish(self, interrupted=False):
+        end = self.last_activity if interrupted else time.perf_counter()
+        self.elapsed = end - self.started
+        self.interrupted = interrupted
+
+    def summary(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.started
+        db_ms = sum(q['execute_ms'] + q['fetch_ms'] for q in self.queries)
+        return {
+            'rerun_id': self.rerun_id,
+            'script_ms': elapsed * 1000,
+            'queries': len(self.queries),
+            'db_ms': db_ms,
+            'checkouts': self.checkouts,
+            'checkout_ms': self.checkout_time * 1000,
+            'slow_queries': sum(1 for q in self.queries if self.is_slow(q)),
+            'interrupted': self.interrupted,
+        }
+
+
+class TracingCursor(RealDictCursor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._trace_entry = None
+
+    def execute(self, query, vars=None):
+        trace = current_trace()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        result = super().execute(query, vars)
+        entry = trace.record_query(query, vars, time.perf_counter() - started)
+        if self.description is None or self.name is not None:
+            entry['rows'] = self.rowcount if self.rowcount >= 0 else None
+        self._trace_entry = entry
+        if trace.explain and self.name is None and entry['execute_ms'] >= trace.slow_ms:
+            entry['explain'] = self._explain(query, vars)
+        return result
+
+    def copy_expert(self, sql, file, size=8192):
+        trace = current_trace()
+        if trace is None:
+            return super().copy_expert(sql, file, size)
+        started = time.perf_counter()
+        result = super().copy_expert(sql, file, size)
+        entry = trace.record_query(sql, None, time.perf_counter() - started)
+        entry['rows'] = self.rowcount if self.rowcount >= 0 else None
+        return result
+
+    def _explain(self, query, vars):
+        if not explainable(normalize_sql(query)):
+            return None
+        # ANALYZE runs the query again; the savepoint keeps a failure from
+        # aborting the caller's transaction.
+        c = self.connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+        try:
+            c.execute("SAVEPOINT trace_explain")
+            try:
+                c.execute(b"EXPLAIN (ANALYZE, BUFFERS) " + self.mogrify(query, vars))
+                plan = "\n".join(row[0] for row in c.fetchall())
+            except psycopg2.Error as e:
+                c.execute("ROLLBACK TO SAVEPOINT trace_explain")
+                plan = f"EXPLAIN failed: {str(e).strip()}"
+            c.execute("RELEASE SAVEPOINT trace_explain")
+            return plan
+        finally:
+            c.close()
+
+    def _timed_fetch(self, fetch, *args):
+        trace = current_trace()
+        if trace is None or self._trace_entry is None:
+            return fetch(*args)
+        started = time.perf_counter()
+        rows = fetch(*args)
+        count = None if rows is None else (1 if isinstance(rows, dict) else len(rows))
+        trace.record_fetch(self._trace_entry, time.perf_counter() - started, count)
+        return rows
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._timed_fetch(super().fetchmany, size)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class Tracer:
+    def __init__(self, enabled=False, slow_ms=200.0, explain=True):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.explain = explain
+
+    def start(self, rerun_id):
+        if not self.enabled:
+            _local.trace = None
+            return None
+        _local.trace = Trace(rerun_id, slow_ms=self.slow_ms, explain=self.explain)
+        return _local.trace
+
+    def finish(self, trace, interrupted=False):
+        if trace is None or trace.elapsed is not None:
+            return trace
+        if current_trace() is trace:
+            _local.trace = None
+        trace.finish(interrupted=interrupted)
+        for entry in trace.queries:
+            logger.info(json.dumps({'event': 'query', 'slow': trace.is_slow(entry), **entry}, default=str))
+        logger.info(json.dumps({'event': 'rerun', **trace.summary()}, default=str))
+        return trace
+
+
+def record_checkout(seconds):
+    trace = current_trace()
+    if trace is not None:
+        trace.record_checkout(seconds)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer(settings):
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer(
+                    enabled=bool(settings.get("QUERY_TRACE", False)),
+                    slow_ms=float(settings.get("QUERY_SLOW_MS", 200)),
+                    explain=bool(settings.get("QUERY_EXPLAIN_SLOW", True)),
+                )
+                if _tracer.enabled and not logger.handlers:
+                    handler = logging.StreamHandler(sys.stderr)
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.addHandler(handler)
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+    return _tracer